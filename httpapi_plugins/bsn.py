@@ -0,0 +1,116 @@
+# Copyright 2016 Jason Edelman <jason@networktocode.com>
+# Network to Code, LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+DOCUMENTATION = '''
+---
+author: Jason Edelman (@jedelman8)
+httpapi: bsn
+short_description: Persistent REST session to a Big Switch BCF or BMF controller
+description:
+    - Keeps one logged in, pooled REST client per controller in the
+      persistent connection process for the whole play. bcf_get_facts
+      and bmf_get_facts tasks run with connection httpapi, and
+      bcf_methods clients given the task's connection, send their REST
+      calls through it instead of logging in and connecting on every task.
+    - The controller is the inventory host (ansible_host), the user and
+      password come from ansible_user and ansible_password. Without
+      ansible_httpapi_port the controller type's default port and
+      protocol are used, otherwise ansible_httpapi_use_ssl picks https.
+options:
+    bsn_controller_type:
+        type: str
+        description:
+            - bcf or bmf
+        default: bcf
+        vars:
+            - name: ansible_bsn_controller_type
+    bsn_pool_size:
+        type: int
+        description:
+            - Connections kept open to the controller
+        default: 10
+        vars:
+            - name: ansible_bsn_pool_size
+'''
+
+import os
+import sys
+
+from ansible.plugins.httpapi import HttpApiBase
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+if os.path.join(ROOT, 'module_utils') not in sys.path:
+    sys.path.insert(0, os.path.join(ROOT, 'module_utils'))
+from bsn_loader import load_bsn
+
+
+class HttpApi(HttpApiBase):
+
+    def __init__(self, connection):
+        super(HttpApi, self).__init__(connection)
+        self._client = None
+
+    def login(self, username, password):
+        # the client logs in when the first call needs it
+        pass
+
+    def logout(self):
+        if self._client is not None:
+            self._client.session.close()
+            self._client = None
+
+    def bsn_controller(self):
+        '''
+        where the calls go, so modules key their caches like they would
+        without the persistent connection
+        '''
+        client = self.client()
+        return dict(controller_ip=client.controller_ip, port=client.port,
+                    protocol=client.protocol, type=client.PROFILE)
+
+    def client(self):
+        if self._client is None:
+            bsn = load_bsn()
+            kind = self.get_option('bsn_controller_type')
+            if kind not in bsn.PROFILES:
+                raise ValueError('ansible_bsn_controller_type must be one of %s'
+                                 % ', '.join(sorted(bsn.PROFILES)))
+            port = self.connection.get_option('port')
+            protocol = None
+            if port:
+                protocol = 'https' if self.connection.get_option('use_ssl') else 'http'
+            client = type('BigSwitchClient', (bsn.BigSwitchClient,), dict(PROFILE=kind))
+            self._client = client(username=self.connection.get_option('remote_user'),
+                                  password=self.connection.get_option('password'),
+                                  controller_ip=self.connection.get_option('host'),
+                                  port=port and str(port),
+                                  protocol=protocol,
+                                  pool_size=self.get_option('bsn_pool_size'))
+        return self._client
+
+    def send_request(self, data, path, method='GET', headers=None):
+        '''
+        one REST call through the persistent client. the response goes
+        back to the module as a dict of status, reason, headers and body
+        '''
+        client = self.client()
+        rsp = client.request(path, method, data, headers)
+        # the client lives for the whole play and the module keeps its own
+        # timings, do not let them pile up here
+        with client._lock:
+            del client.timings[:]
+        return dict(status=rsp.status_code, reason=rsp.reason,
+                    headers=dict(rsp.headers), body=rsp.text)
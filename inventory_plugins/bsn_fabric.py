@@ -0,0 +1,225 @@
+# Copyright 2016 Jason Edelman <jason@networktocode.com>
+# Network to Code, LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+DOCUMENTATION = '''
+    name: bsn_fabric
+    plugin_type: inventory
+    short_description: Switches of Big Switch fabrics as inventory hosts
+    description:
+        - Turns the switches BCF controllers report under info/fabric/switch
+          and BMF controllers under core/switch into hosts, using the
+          clients of bcf_get_facts and bmf_get_facts.
+        - Hosts are grouped by controller type (bcf_switches,
+          bmf_switches), by fabric role (bcf_leaf, bcf_spine), by fabric
+          connection state (bcf_connected, ...) and by software version
+          (sw_...).
+        - Controllers are queried concurrently. The switches of each
+          controller are kept in cache_dir for cache_ttl seconds, so only
+          expired controllers are queried again. A controller that cannot
+          be reached falls back to its expired entry with a warning.
+        - Keep inventory_plugins next to library and module_utils, and
+          enable the plugin in ansible.cfg ([inventory] enable_plugins).
+    options:
+        plugin:
+            description: Marks the file as a source for this plugin
+            required: true
+            choices: ['bsn_fabric']
+        controllers:
+            description:
+                - Controllers to query. Each entry has a host and a type,
+                  bcf or bmf, and optionally username, password, port and
+                  protocol. A host may be listed once per type and port.
+            type: list
+            required: true
+        username:
+            description: Username used to login to the controllers
+            default: admin
+            env:
+                - name: BSN_USERNAME
+        password:
+            description: Password used to login to the controllers
+            env:
+                - name: BSN_PASSWORD
+        cache_dir:
+            description: Directory the switches of each controller are kept in
+            default: ~/.ansible/bsn_cache
+        cache_ttl:
+            description: Seconds the switches of a controller are reused
+            type: int
+            default: 300
+        controller_concurrency:
+            description: Controllers queried at the same time
+            type: int
+            default: 8
+'''
+
+EXAMPLES = '''
+# bsn_fabric.yml
+plugin: bsn_fabric
+controllers:
+  - host: 10.1.1.100
+    type: bcf
+  - host: 10.1.2.100
+    type: bmf
+username: admin
+password: bsn123
+cache_ttl: 600
+
+# ansible-inventory -i bsn_fabric.yml --graph
+# ansible-inventory -i bsn_fabric.yml --list --flush-cache
+'''
+
+import os
+import re
+import sys
+
+from ansible.errors import AnsibleParserError
+from ansible.plugins.inventory import BaseInventoryPlugin
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+if os.path.join(ROOT, 'module_utils') not in sys.path:
+    sys.path.insert(0, os.path.join(ROOT, 'module_utils'))
+from bsn_loader import load_bsn, load_library
+
+# bump when the cached switch layout changes
+INVENTORY_CACHE_FORMAT = '1'
+
+# controller type -> fact module whose client lists its switches
+FACT_MODULES = dict(bcf='bcf_get_facts', bmf='bmf_get_facts')
+
+_loaded = {}
+
+
+def load(name):
+    '''
+    a fact module from the library directory of this repository
+    '''
+    if name in _loaded:
+        return _loaded[name]
+    module = load_library(name, 'bsn_fabric_' + name)
+    _loaded[name] = module
+    return module
+
+
+def safe_group(name):
+    return re.sub(r'[^A-Za-z0-9_]', '_', name).lower()
+
+
+def switch_hosts(kind, nodes):
+    '''
+    fabric_nodes facts -> [(hostname, variables, groups)]. the hostname
+    is None for a node without a name, alias or dpid
+    '''
+    hosts = []
+    for node in nodes:
+        variables = dict(('bsn_' + key, value) for key, value in node.items())
+        groups = [kind + '_switches']
+        if node.get('role'):
+            groups.append(kind + '_' + node['role'])
+        if node.get('fabric_state'):
+            groups.append(kind + '_' + node['fabric_state'])
+        if node.get('sw'):
+            groups.append('sw_' + node['sw'])
+        name = node.get('name') or node.get('alias') or node.get('dpid')
+        hosts.append((name, variables, [safe_group(group) for group in groups]))
+    return hosts
+
+
+class InventoryModule(BaseInventoryPlugin):
+
+    NAME = 'bsn_fabric'
+
+    def verify_file(self, path):
+        return (super(InventoryModule, self).verify_file(path) and
+                path.endswith(('bsn_fabric.yml', 'bsn_fabric.yaml')))
+
+    def parse(self, inventory, loader, path, cache=True):
+        super(InventoryModule, self).parse(inventory, loader, path, cache)
+        self._read_config_data(path)
+
+        bsn = load_bsn()
+        store = bsn.FileCache(self.get_option('cache_dir'), 'inventory')
+        ttl = self.get_option('cache_ttl')
+
+        controllers = {}
+        for entry in self.get_option('controllers'):
+            if (not isinstance(entry, dict) or not entry.get('host') or
+                    entry.get('type') not in FACT_MODULES):
+                raise AnsibleParserError('%s: each controller needs a host and a type, '
+                                         'bcf or bmf: %r' % (path, entry))
+            # a bcf and a bmf controller, or two ports, may share a host
+            key = (entry['type'], entry['host'], str(entry.get('port') or ''))
+            if key in controllers:
+                raise AnsibleParserError('%s: controller %s listed twice: %r'
+                                         % (path, entry['host'], entry))
+            controllers[key] = entry
+
+        def cache_key(key):
+            return key + (INVENTORY_CACHE_FORMAT,)
+
+        # cache is false with --flush-cache
+        switches, expired = {}, []
+        for key in controllers:
+            nodes, age = store.get(cache_key(key))
+            if nodes is not None and cache and age < ttl:
+                switches[key] = nodes
+            else:
+                expired.append(key)
+
+        def gather(key):
+            entry = controllers[key]
+            client = load(FACT_MODULES[entry['type']]).BigCloudFabric
+            fabric = client(controller_ip=entry['host'],
+                            username=entry.get('username') or self.get_option('username'),
+                            password=entry.get('password') or self.get_option('password'),
+                            port=entry.get('port') and str(entry['port']),
+                            protocol=entry.get('protocol'),
+                            cache_dir=self.get_option('cache_dir'))
+            nodes = fabric.facts(['nodes'])['fabric_nodes']
+            store.set(cache_key(key), nodes)
+            return nodes
+
+        # import the clients here, not in the threads below
+        for key in expired:
+            load(FACT_MODULES[controllers[key]['type']])
+        results = bsn.gather_controllers(expired, gather,
+                                         self.get_option('controller_concurrency'))
+        for key, result in results.items():
+            if result['error'] is None:
+                switches[key] = result['facts']
+                continue
+            stale = store.get(cache_key(key))[0]
+            self.display.warning('bsn_fabric: %s controller %s could not be queried (%s)%s'
+                                 % (key[0], key[1], result['error'],
+                                    ', using its cached switches' if stale is not None else ''))
+            if stale is not None:
+                switches[key] = stale
+
+        for key in sorted(switches):
+            kind, host = key[0], key[1]
+            for name, variables, groups in switch_hosts(kind, switches[key]):
+                if not name:
+                    self.display.warning('bsn_fabric: %s controller %s reported a switch '
+                                         'without a name, alias or dpid, skipping it'
+                                         % (kind, host))
+                    continue
+                variables['bsn_controller'] = host
+                self.inventory.add_host(name)
+                for group in groups:
+                    self.inventory.add_group(group)
+                    self.inventory.add_child(group, name)
+                for var, value in variables.items():
+                    self.inventory.set_variable(name, var, value)
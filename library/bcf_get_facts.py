@@ -27,20 +27,247 @@ options:
     controller:
         description:
             - Hostame or IP address of BCF controller.
-        required: true
+              Either controller or controllers is required, unless the
+              task runs with connection httpapi (see the bsn httpapi
+              plugin); the calls then go to the connection's controller
+              over its persistent, logged in session.
+        required: false
+    controllers:
+        description:
+            - List of BCF controllers to gather facts from concurrently in
+              this one task, all with the same credentials and options.
+              Facts are returned in bsnbcf_controllers keyed by
+              controller, each with its own error and elapsed time; the
+              task only fails when no controller answered. facts_cache
+              applies to each controller, stale_while_revalidate does not.
+        required: false
+    controller_concurrency:
+        description:
+            - Number of controllers gathered in parallel when controllers
+              is used
+        required: false
+        default: 8
     username:
         description:
-            - Username used to login to the controller
-        required: true
+            - Username used to login to the controller. Required unless
+              the task runs with connection httpapi.
+        required: false
     password:
         description:
-            - Password used to login to the controller
-        required: true
+            - Password used to login to the controller. Required unless
+              the task runs with connection httpapi.
+        required: false
+    pool_size:
+        description:
+            - Maximum number of connections kept open to the controller
+        required: false
+        default: 10
+    keepalive:
+        description:
+            - Reuse connections to the controller across REST calls
+        required: false
+        default: true
+        choices: [true, false]
+    connect_timeout:
+        description:
+            - Seconds to wait for a connection to the controller
+        required: false
+        default: 10
+    read_timeout:
+        description:
+            - Seconds to wait for the controller to answer a REST call
+        required: false
+        default: 60
+    max_concurrency:
+        description:
+            - Number of independent REST calls issued in parallel while
+              gathering facts. 1 issues them one after another.
+        required: false
+        default: 1
+    gather_subset:
+        description:
+            - Fact sections to collect, any of version, hostname, cluster,
+              nodes and summary, or all. Prefix a section with ! to skip
+              it. Only the REST calls the selected sections need are made.
+        required: false
+        default: ['all']
+    cookie_cache:
+        description:
+            - Keep the controller session cookie on disk, keyed by
+              controller and username, so later tasks skip the login.
+              A cookie the controller rejects triggers a fresh login.
+        required: false
+        default: false
+        choices: [true, false]
+    cookie_cache_ttl:
+        description:
+            - Seconds a cached session cookie is reused before logging in again
+        required: false
+        default: 900
+    cache_dir:
+        description:
+            - Directory holding the on-disk caches, created with mode 0700
+        required: false
+        default: ~/.ansible/bsn_cache
+    flush_cookie_cache:
+        description:
+            - Drop the cached session cookie for this controller and
+              username before running
+        required: false
+        default: false
+        choices: [true, false]
+    facts_cache:
+        description:
+            - Keep the gathered facts on disk, keyed by controller and
+              gather_subset, and serve them without contacting the
+              controller while they are younger than facts_cache_ttl
+        required: false
+        default: false
+        choices: [true, false]
+    facts_cache_ttl:
+        description:
+            - Seconds cached facts are served as fresh
+        required: false
+        default: 300
+    stale_while_revalidate:
+        description:
+            - Seconds past facts_cache_ttl during which the cached facts
+              are still returned immediately while a background process
+              gathers fresh ones for the next run. Runs that start while a
+              refresh is underway return the cached facts as well.
+        required: false
+        default: 0
+    response_cache:
+        description:
+            - Keep the ETag, Last-Modified and body hash of every fact
+              GET, and the facts built from it, in cache_dir. The next run
+              asks the controller for changes only when it sends an ETag
+              or Last-Modified, and reuses the facts of endpoints whose
+              response did not change instead of decoding them again.
+        required: false
+        default: false
+        choices: [true, false]
+    facts_delta:
+        description:
+            - Keep the facts of each run in cache_dir and, instead of the
+              facts, return what changed since the previous run in
+              bsnbcf_delta. changed is true when the fabric drifted. The
+              first run reports every node as added.
+        required: false
+        default: false
+        choices: [true, false]
+    profile:
+        description:
+            - Time every REST call (dns, connect, tls, time to first byte,
+              total, response bytes and json decode) and return the
+              timings in bsn_timings
+        required: false
+        default: false
+        choices: [true, false]
+    trace_file:
+        description:
+            - File the timed REST calls are appended to, one json object
+              per line tagged with the controller. Implies profile.
+        required: false
+    retries:
+        description:
+            - Times a REST call that timed out, could not connect or got
+              a 502, 503 or 504 is repeated. Only GET, PUT, DELETE and the
+              login are repeated.
+        required: false
+        default: 2
+    retry_backoff:
+        description:
+            - Seconds of the first pause between retries; it doubles on
+              every retry and a random part of it is used (full jitter)
+        required: false
+        default: 0.5
+    circuit_breaker:
+        description:
+            - Remember failures per controller in cache_dir, across tasks
+              and forks. Once circuit_breaker_threshold calls in a row
+              failed, calls to that controller fail immediately until
+              circuit_breaker_cooldown seconds passed since the last failure.
+        required: false
+        default: false
+        choices: [true, false]
+    circuit_breaker_threshold:
+        description:
+            - Failed calls in a row that open the circuit breaker
+        required: false
+        default: 3
+    circuit_breaker_cooldown:
+        description:
+            - Seconds the circuit breaker stays open
+        required: false
+        default: 60
+    rate_limit:
+        description:
+            - REST calls per second allowed to each controller, shared by
+              every fork on the Ansible host through cache_dir. Defaults
+              to the BSN_RATE_LIMIT environment variable; 0 disables it.
+        required: false
+    rate_burst:
+        description:
+            - Calls that may go out at once before rate_limit applies.
+              Defaults to BSN_RATE_BURST, else to rate_limit.
+        required: false
+    max_in_flight:
+        description:
+            - Calls the task has open to each controller at any time;
+              waiting GETs are sent before waiting writes. Defaults to the
+              BSN_MAX_IN_FLIGHT environment variable; 0 disables it.
+        required: false
+    broker:
+        description:
+            - Send the REST calls through a request broker on the host the
+              module runs on, started by the first task that needs it and
+              listening on a unix socket in cache_dir. The broker stays
+              logged in, sends identical GETs of tasks running at once as
+              one request and reuses GET responses for broker_ttl seconds,
+              so forks gathering from the same controller share their
+              calls. It exits after two minutes without a request.
+        required: false
+        default: false
+        choices: [true, false]
+    broker_ttl:
+        description:
+            - Seconds a GET response the broker received may be reused
+        required: false
+        default: 5
 '''
 
 EXAMPLES = '''
 - bcf_get_facts: controller=10.1.1.100 username=admin password=bsn123
 
+- bcf_get_facts: controller=10.1.1.100 username=admin password=bsn123 pool_size=4 read_timeout=120
+
+- bcf_get_facts: controller=10.1.1.100 username=admin password=bsn123 max_concurrency=8
+
+- bcf_get_facts: controller=10.1.1.100 username=admin password=bsn123 gather_subset=version,summary
+
+- bcf_get_facts: controller=10.1.1.100 username=admin password=bsn123 gather_subset=!nodes
+
+- bcf_get_facts: controller=10.1.1.100 username=admin password=bsn123 cookie_cache=true
+
+- bcf_get_facts: controller=10.1.1.100 username=admin password=bsn123 facts_cache=true facts_cache_ttl=120 stale_while_revalidate=600
+
+- bcf_get_facts: controller=10.1.1.100 username=admin password=bsn123 profile=true trace_file=/tmp/bcf_trace.json
+
+- bcf_get_facts: controller=10.1.1.100 username=admin password=bsn123 max_concurrency=8 rate_limit=20 max_in_flight=4
+
+- bcf_get_facts: controller=10.1.1.100 username=admin password=bsn123 broker=true
+
+- bcf_get_facts: controller=10.1.1.100 username=admin password=bsn123 facts_delta=true
+  register: drift
+
+- bcf_get_facts:
+    controllers: "{{ groups['bcf'] }}"
+    username: admin
+    password: bsn123
+    controller_concurrency: 16
+  run_once: true
+
 '''
 
 RETURN = '''
@@ -151,60 +378,164 @@ bsnbcf:
         }
     }
 }
-
-
+bsnbcf_delta:
+    description: Changes since the previous run. fabric_nodes lists the
+        nodes added, removed and changed (by dpid), controller_roles the
+        controllers whose role changed, and summary, cluster and facts the
+        other values that changed, each as old and new. Empty when
+        nothing changed.
+    returned: when facts_delta is true
+    type: dictionary
+    sample:
+        "bsnbcf_delta": {
+            "fabric_nodes": {
+                "added": [],
+                "removed": [],
+                "changed": [
+                    {
+                        "dpid": "00:00:00:00:00:02:00:01",
+                        "changes": {
+                            "fabric_state": {"old": "connected", "new": "not-connected"}
+                        }
+                    }
+                ]
+            },
+            "controller_roles": {
+                "10.10.12.20": {"old": "active", "new": "standby"}
+            },
+            "summary": {
+                "leaves_connected": {"old": 6, "new": 5}
+            }
+        }
+bsn_connection:
+    description: Connection reuse statistics for the REST calls made
+    returned: when the controller was queried
+    type: dictionary
+    sample:
+        "bsn_connection": {
+            "requests": 9,
+            "connections_opened": 1,
+            "connections_reused": 8,
+            "handshake_saved": 0.5384,
+            "calls": [
+                {
+                    "uri": "/api/v1/auth/login",
+                    "verb": "POST",
+                    "status": 200,
+                    "elapsed": 0.1021,
+                    "new_connection": true
+                }
+            ]
+        }
+bsn_facts_cache:
+    description: Whether the facts came from the cache (hit), from an
+        expired cache entry being refreshed in the background (stale) or
+        from the controller (miss), and their age in seconds
+    returned: when facts_cache is true
+    type: dictionary
+    sample:
+        "bsn_facts_cache": {
+            "status": "hit",
+            "age": 42.7
+        }
+bsn_timings:
+    description: Timings of each REST call in seconds, and per endpoint
+        the number of calls, total and slowest time and bytes received,
+        slowest endpoint first. dns, connect and tls are only present on
+        calls that opened a connection.
+    returned: when profile is true and the controller was queried
+    type: dictionary
+    sample:
+        "bsn_timings": {
+            "calls": [
+                {
+                    "uri": "/api/v1/data/controller/applications/bcf/info/fabric/switch",
+                    "verb": "GET",
+                    "status": 200,
+                    "start": 1476789012.1234,
+                    "dns": 0.0001,
+                    "connect": 0.0012,
+                    "tls": 0.0213,
+                    "ttfb": 0.1802,
+                    "elapsed": 0.2107,
+                    "bytes": 48211,
+                    "decode": 0.0031,
+                    "new_connection": true
+                }
+            ],
+            "endpoints": [
+                {
+                    "endpoint": "GET /api/v1/data/controller/applications/bcf/info/fabric/switch",
+                    "calls": 1,
+                    "total": 0.2107,
+                    "slowest": 0.2107,
+                    "bytes": 48211
+                }
+            ]
+        }
+bsnbcf_controllers:
+    description: Facts of each controller, keyed by controller, with the
+        error that prevented gathering them, the seconds it took and,
+        with profile, its timings. With facts_delta the facts are
+        replaced by delta, laid out like bsnbcf_delta, and the result is
+        not set as a fact.
+    returned: when controllers is used
+    type: dictionary
+    sample:
+        "bsnbcf_controllers": {
+            "10.1.1.100": {
+                "facts": {"version": "3.5.0"},
+                "error": null,
+                "elapsed": 0.8123
+            },
+            "10.1.1.101": {
+                "facts": null,
+                "error": "401 Client Error: Unauthorized",
+                "elapsed": 0.1032
+            }
+        }
 '''
 
 import json
-import requests
-
-requests.packages.urllib3.disable_warnings()
-
+from ansible.module_utils.bsn import (BigSwitchClient, parse_gather_subset,
+                                      facts_argument_spec, run_facts_module)
 
-class BigCloudFabric(object):
+# bump when the layout of the facts dict changes so cached facts and
+# snapshots written by an older module are not used
+FACTS_CACHE_FORMAT = '1'
 
-    def __init__(self,
-                 username='admin',
-                 password='bsn123',
-                 controller_ip='192.168.200.102'):
 
-        self.username = username
-        self.password = password
-        self.controller_ip = controller_ip
-        self.base_url = 'https://' + self.controller_ip + ':8443'
-        self.session_cookie = self.get_session_cookie()
+class BigCloudFabric(BigSwitchClient):
 
-    def get_session_cookie(self):
-        url = self.base_url + '/api/v1/auth/login'
-        data = {"password": self.password, "user": self.username}
-        rsp = requests.post(url, json.dumps(data), verify=False)
+    PROFILE = 'bcf'
+    FACTS_FORMAT = FACTS_CACHE_FORMAT
 
-        return rsp.cookies
-
-    def _make_request(self):
-        params = dict(cookies=self.session_cookie, verify=False)
-        if self.verb == 'GET':
-            rsp = requests.get(self.url, **params)
-        elif self.verb == 'PUT':
-            rsp = requests.put(self.url, self.data, **params)
-        elif self.verb == 'POST':
-            rsp = requests.post(self.url, self.data, **params)
-        return rsp
-
-    def _execute(self):
-        if not self.session_cookie:
-            self.get_session_cookie()
-        response = self._make_request()
+    # independent GETs behind facts(), issued together by api_calls()
+    FACT_URIS = dict(
+        version='/api/v1/data/controller/core/version/appliance',
+        local='/api/v1/data/controller/os/config/local?config=true',
+        cluster='/api/v1/data/controller/cluster',
+        redundancy='/api/v1/data/controller/core/high-availability/redundancy-status',
+        ha_nodes='/api/v1/data/controller/core/high-availability/node',
+        fabric_nodes='/api/v1/data/controller/applications/bcf/info/fabric/switch',
+        virtual_ip='/api/v1/data/controller/os/config/global/virtual-ip',
+        summary='/api/v1/data/controller/applications/bcf/info/summary/fabric',
+    )
 
-        return response
+    # the only fields build_nodes reads of each switch
+    FACT_FIELDS = dict(
+        fabric_nodes=['name', 'fabric-role', 'dpid', 'fabric-connection-state',
+                      'software-description'],
+    )
 
-    def api_call(self, uri, verb='GET', data={}):
-        self.url = self.base_url + uri
-        self.data = json.dumps(data)
-        self.verb = verb
-        output = self._execute()
-        json_out = json.loads(output.text)
-        return json_out
+    # gather_subset sections and the FACT_URIS each of them needs
+    SUBSETS = dict(
+        version=['version'],
+        hostname=['local'],
+        cluster=['cluster', 'redundancy', 'ha_nodes', 'virtual_ip'],
+        nodes=['fabric_nodes'],
+        summary=['summary'],
+    )
 
     def _verb_check(self, resource_list):
         if len(resource_list) == 0:
@@ -212,75 +543,78 @@ class BigCloudFabric(object):
         else:
             return 'POST'
 
-    def facts(self):
+    def facts(self, gather_subset=None):
+
+        subset = parse_gather_subset(gather_subset, self.SUBSETS)
+
+        facts = {}
+        facts['vendor'] = 'big_switch_networks'
+        for section in self.gather_sections(subset).values():
+            facts.update(section)
+        return facts
 
-        # GET VERSION
-        uri = '/api/v1/data/controller/core/version/appliance'
-        version = self.api_call(uri, 'GET')[0]
+    # GET VERSION
+    def build_version(self, rsp):
+        version = rsp['version'][0]
+        return dict(version=version['version'],
+                    platform=version['release-string'])
 
-        # GET HOSTNAME
-        uri = '/api/v1/data/controller/os/config/local?config=true'
-        data = self.api_call(uri, 'GET')[0]
-        local_hostname = data['network']['hostname']
+    # GET HOSTNAME
+    def build_hostname(self, rsp):
+        return dict(hostname=rsp['local'][0]['network']['hostname'])
 
-        # GET CLUSTER INFORMATION
-        uri = '/api/v1/data/controller/cluster'
-        cluster_data = self.api_call(uri, 'GET')[0]
+    # GET CLUSTER INFORMATION
+    def build_cluster(self, rsp):
+        cluster_data = rsp['cluster'][0]
 
         cluster_name = cluster_data['name']
         description = None
         if cluster_data.get('description'):
             description = cluster_data['description']
 
-        uri = '/api/v1/data/controller/core/high-availability/redundancy-status'
-        ha = self.api_call(uri, 'GET')[0]
+        ha = rsp['redundancy'][0]
 
         rstatus = {'status': ha['status'], 'msg': ha['message']}
 
-        uri = '/api/v1/data/controller/core/high-availability/node'
-        controllers_info = self.api_call(uri, 'GET')
-
         controllers = []
-        for each in controllers_info:
+        for each in rsp['ha_nodes']:
             temp = {}
             temp['hostname'] = each.get('hostname')
             temp['uptime'] = each.get('uptime')
             temp['role'] = each.get('role')
             controllers.append(temp)
 
-        # GET INFO ON ALL NODES IN FABRIC
-        uri = '/api/v1/data/controller/applications/bcf/info/fabric/switch'
-        node_info = self.api_call(uri, 'GET')
-
-        nodes = []
-        for each in node_info:
-            temp = {}
-            temp['name'] = each.get('name')
-            temp['role'] = each.get('fabric-role')
-            temp['dpid'] = each.get('dpid')
-            temp['fabric_state'] = each.get('fabric-connection-state')
-            temp['sw'] = each.get('software-description')
-            nodes.append(temp)
-
         # GET VIP OF CONTROLLER
-        uri = '/api/v1/data/controller/os/config/global/virtual-ip'
-        vip_info = self.api_call(uri, 'GET')[0]
+        vip_info = rsp['virtual_ip'][0]
         vip = None
         if vip_info.get('ipv4-address'):
             vip = vip_info['ipv4-address']
 
-        cluster = dict(
+        return dict(cluster=dict(
                 name=cluster_name,
                 description=description,
                 redundancy_status=rstatus,
                 controllers=controllers,
                 virtual_ip=vip
-                )
+                ))
+
+    # GET INFO ON ALL NODES IN FABRIC
+    def build_nodes(self, rsp):
+        nodes = []
+        for each in rsp['fabric_nodes']:
+            temp = {}
+            temp['name'] = each.get('name')
+            temp['role'] = each.get('fabric-role')
+            temp['dpid'] = each.get('dpid')
+            temp['fabric_state'] = each.get('fabric-connection-state')
+            temp['sw'] = each.get('software-description')
+            nodes.append(temp)
+        return dict(fabric_nodes=nodes)
 
-        uri = '/api/v1/data/controller/applications/bcf/info/summary/fabric'
-        fabric_summary = self.api_call(uri, 'GET')[0]
+    def build_summary(self, rsp):
+        fabric_summary = rsp['summary'][0]
 
-        summary = dict(
+        return dict(summary=dict(
             overall_status=fabric_summary.get('overall-status'),
             errors=fabric_summary.get('errors'),
             warnings=fabric_summary.get('warnings'),
@@ -292,41 +626,17 @@ class BigCloudFabric(object):
             tenants=fabric_summary.get("tenant-count"),
             leaves_connected=fabric_summary.get("num-leaves-connected" ),
             vswitches_connected=fabric_summary.get("num-vswitches-connected")
-            )
-
-        facts = {}
-        facts['cluster'] = cluster
-        facts['fabric_nodes'] = nodes
-        facts['version'] = version['version']
-        facts['platform'] = version['release-string']
-        facts['hostname'] = local_hostname
-        facts['vendor'] = 'big_switch_networks'
-        facts['summary'] = summary
-
-        return facts
+            ))
 
 
 def main():
     module = AnsibleModule(
-        argument_spec=dict(
-            controller=dict(required=True),
-            username=dict(required=True),
-            password=dict(required=True),
-        ),
+        argument_spec=facts_argument_spec(),
+        mutually_exclusive=[['controller', 'controllers']],
         supports_check_mode=False
     )
+    run_facts_module(module, BigCloudFabric, 'bsnbcf')
 
-    controller = module.params['controller']
-    username = module.params['username']
-    password = module.params['password']
-
-    fabric = BigCloudFabric(controller_ip=controller,
-                            username=username,
-                            password=password)
-
-    facts = fabric.facts()
-
-    module.exit_json(ansible_facts=dict(bsnbcf=facts))
 
 """
 def test():
@@ -340,7 +650,8 @@ def test():
 
     facts = fabric.facts()
 
-    print json.dumps(facts, indent=4)
+    print(json.dumps(facts, indent=4))
+    print(json.dumps(fabric.connection_stats(), indent=4))
 """
 
 from ansible.module_utils.basic import *
@@ -1,73 +1,112 @@
 #!/usr/bin/env python
 
-import urllib2
+import os
+import sys
 import json
+import time
+import threading
 
+try:
+    from ansible.module_utils.bsn import BigSwitchClient
+except ImportError:
+    # imported as a plain library from a checkout of this repository
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(
+        os.path.abspath(__file__))), 'module_utils'))
+    from bsn import BigSwitchClient
 
-class BigCloudFabric(object):
+# answers of a controller that does not take a nested write of a
+# resource tree; composed writes then go back to one call per resource
+COMPOSE_REJECTED = (400, 405, 415, 422, 501)
 
-    PROTOCOL = 'https'
-    PORT = '8443'
 
-    def __init__(self, username='admin', password='bigswitch',
-                 controller_ip='192.168.200.102'):
-
-        self.session_cookie = None
-
-        self.username = username
-        self.password = password
-        self.controller_ip = controller_ip
-        self.session_cookie = self.get_session_cookie()
-        # gets session cookie on initialization
-        # not sure how long this is valid for
+class BigCloudFabric(BigSwitchClient):
+    '''
+    provisioning calls on top of the shared client, which logs in on
+    initialization and again whenever the controller rejects the cookie.
+    given connection=Connection(module._socket_path) in a task run with
+    connection httpapi, the calls use the bsn httpapi plugin's session.
+    given journal, the path of a Journal, the switches, tenants, segments
+    and segment interfaces it confirms are skipped without asking the
+    controller, and every one written is recorded in it. with
+    composed_writes a segment and its membership rules, and a segment
+    interface and its subnet, are written as one nested request; if the
+    controller refuses it they are sent one by one on the same pooled
+    connection, as without it
+    '''
 
-    def rest_request(self, url, obj, verb='GET'):
-        headers = {'Content-type': 'application/json'}
+    PROFILE = 'bcf'
 
-        # if we have session variables add them
-        if self.session_cookie:
-            headers["Cookie"] = "session_cookie=%s" % self.session_cookie
-            request = urllib2.Request(url, obj, headers)
-            request.get_method = lambda: verb
-            response = urllib2.urlopen(request)
-            result = response.read()
-            return result
-        else:
-            request = urllib2.Request(url, obj, headers)
-            request.get_method = lambda: verb
-            response = urllib2.urlopen(request)
-            result = response.read()
-            return result
+    def __init__(self, *args, **kwargs):
+        journal = kwargs.pop('journal', None)
+        # turned off by the first nested write the controller refuses
+        self.composed_writes = kwargs.pop('composed_writes', False)
+        super(BigCloudFabric, self).__init__(*args, **kwargs)
+        self.journal = Journal(journal) if journal else None
+        # statuses of the writes of the item being journaled on this thread
+        self._journal_item = threading.local()
 
-    def get_session_cookie(self):
+    def confirmed(self, *key):
+        '''
+        whether the journal has the item of key, e.g. ('tenant', name),
+        as written by an earlier run
+        '''
+        return self.journal is not None and self.journal.confirmed(key)
 
-        urlLogin = 'https://' + self.controller_ip + ':8443/api/v1/auth/login'
-        data1 = {"password": str(self.password), "user": str(self.username)}
-        output = self.rest_request(str(urlLogin), json.dumps(data1), "POST")
-        authObj = json.loads(output)
-        return authObj["session_cookie"]
+    def _journaled(self, key, write):
+        '''
+        run write(), the REST calls of one item, between a begin and a
+        commit record of the journal. an item without its commit is
+        checked against the controller again by the next run
+        '''
+        if self.journal is None:
+            return write()
+        self.journal.begin(key)
+        self._journal_item.statuses = []
+        try:
+            result = write()
+            self.journal.commit(key, self._journal_item.statuses)
+        finally:
+            self._journal_item.statuses = None
+        return result
+
+    def _write_call(self, uri, verb, data, refused=()):
+        '''
+        send one write, raising on an error status other than those of
+        refused, for which False is returned instead
+        '''
+        rsp = self.request(uri, verb, data)
+        if rsp.status_code in refused:
+            return False
+        rsp.raise_for_status()
+        statuses = getattr(self._journal_item, 'statuses', None)
+        if statuses is not None:
+            statuses.append(rsp.status_code)
+        return True
+
+    def _composed_write(self, uri, verb, data):
+        '''
+        one nested write of a resource tree, if the controller takes them
+        '''
+        if not self.composed_writes:
+            return False
+        if self._write_call(uri, verb, data, COMPOSE_REJECTED):
+            return True
+        self.composed_writes = False
+        return False
 
     def get_api_call(self, uri, verb='GET', data=None):
-        # empty data dictionary for GET APIs
-        url = 'https://' + self.controller_ip + ':8443' + uri
-
-        if verb == 'GET':
-            data = {}
-
-        obj = json.dumps(data)
-        output = self.rest_request(url, obj, verb)
-        json_out = json.loads(output)
+        return self.api_call(uri, verb, data)
 
-        return json_out
-
-    def api_call(self, uri, verb='GET', data=None):
-        url = 'https://' + self.controller_ip + ':8443' + uri
-
-        if verb == 'GET':
-            data = {}
-
-        obj = json.dumps(data)
-        output = self.rest_request(url, obj, verb)
+    def get_resource(self, uri):
+        '''
+        keyed lookup through a predicate uri, e.g. tenant[name="x"]. only
+        the selected resource is sent back by the controller. returns it,
+        or None if it does not exist
+        '''
+        found = self.get_api_call(uri, 'GET')
+        if isinstance(found, list):
+            return found[0] if found else None
+        return found or None
 
     def get_switches(self):
         uri = '/api/v1/data/controller/core/switch-config'
@@ -78,39 +117,124 @@ class BigCloudFabric(object):
         data = {}
         uri = '/api/v1/data/controller/core/switch-config[name="' + name + '"]'
         self.api_call(uri, 'DELETE', data)
+        if self.journal is not None:
+            self.journal.forget(('switch', name))
 
-    def provision_switch(self, name, mac_address, role, group=None):
-        switches = self.get_switches()
+    def provision_switch(self, name, mac_address, role, group=None,
+                         switches=None):
+        '''
+        switches: optional ResourceIndex of get_switches() shared by many
+        calls so the switch config is fetched once. without it only the
+        named switch is looked up
+        '''
+        if self.confirmed('switch', name):
+            return  # written by an earlier run
+        if switches is None:
+            uri = '/api/v1/data/controller/core/switch-config[name="' + name + '"]'
+            if self.get_resource(uri) is not None:
+                return  # 'Device already loaded in controller'
+            self._write_switch(name, mac_address, role, 'PUT', uri)
+            return
         # print json.dumps( switches, indent=4)
         verb = self.verb_check(switches)
         exists, dummy = self.resource_exists(switches, 'name', name)
 
         if not exists:
-            data = {'dpid': '00:00:' + mac_address,
-                    'name': name, 'fabric-role': role}
-            uri = '/api/v1/data/controller/core/switch-config'
-            self.api_call(uri, verb, data)
+            switches.add(self._write_switch(name, mac_address, role, verb))
         else:
             msg = 'Device already loaded in controller'
 
+    def _write_switch(self, name, mac_address, role, verb,
+                      uri='/api/v1/data/controller/core/switch-config'):
+        data = {'dpid': '00:00:' + mac_address,
+                'name': name, 'fabric-role': role}
+        self._journaled(('switch', name), lambda: self._write_call(uri, verb, data))
+        return data
+
+    def provision_switches(self, switches, max_concurrency=8):
+        '''
+        provision many switches against a single fetch of the switch
+        config. switches is a list of dicts with the provision_switch
+        arguments (name, mac_address, role, optional group). returns one
+        status dict per switch, in order
+        '''
+        remaining = [each for each in switches if not self.confirmed('switch', each['name'])]
+        existing = ResourceIndex(self.get_switches() if remaining else [])
+        verb = self.verb_check(existing)
+        report, pending = [], []
+        for each in switches:
+            status = {'name': each['name']}
+            report.append(status)
+            if self.confirmed('switch', each['name']):
+                status['status'] = 'journaled'
+                continue
+            if self.resource_exists(existing, 'name', each['name'])[0]:
+                status['status'] = 'exists'
+                continue
+            existing.add({'name': each['name']})
+            pending.append((status, lambda verb, each=each: self._write_switch(
+                each['name'], each['mac_address'], each['role'], verb)))
+        self._apply_batch(pending, verb, max_concurrency)
+        return report
+
     def get_tenants(self):
         uri = '/api/v1/data/controller/applications/bcf/tenant'
         tenants = self.get_api_call(uri, 'GET')
         return tenants
 
-    def create_tenant(self, tenant_name):
-        tenants = self.get_tenants()
+    def create_tenant(self, tenant_name, tenants=None):
+        '''
+        tenants: optional ResourceIndex of get_tenants() shared by many
+        calls so the tenant list is fetched once. without it only the
+        named tenant is looked up
+        '''
+        if self.confirmed('tenant', tenant_name):
+            return False  # written by an earlier run
+        if tenants is None:
+            uri = '/api/v1/data/controller/applications/bcf/tenant[name="' + tenant_name + '"]'
+            if self.get_resource(uri) is not None:
+                return False  # 'Tenant already created in controller'
+            self._write_tenant(tenant_name, 'PUT', uri)
+            return True
         # print json.dumps( tenants, indent=4)
         verb = self.verb_check(tenants)
         exists, dummy = self.resource_exists(tenants, 'name', tenant_name)
         if not exists:
-            data = {'name': tenant_name}
-            uri = '/api/v1/data/controller/applications/bcf/tenant'
-            self.api_call(uri, verb, data)
+            tenants.add(self._write_tenant(tenant_name, verb))
             return True
         else:
             return False  # 'Tenant already created in controller'
 
+    def _write_tenant(self, tenant_name, verb,
+                      uri='/api/v1/data/controller/applications/bcf/tenant'):
+        data = {'name': tenant_name}
+        self._journaled(('tenant', tenant_name), lambda: self._write_call(uri, verb, data))
+        return data
+
+    def create_tenants(self, tenant_names, max_concurrency=8):
+        '''
+        create many tenants against a single fetch of the tenant list.
+        returns one status dict per tenant name, in order
+        '''
+        remaining = [name for name in tenant_names if not self.confirmed('tenant', name)]
+        existing = ResourceIndex(self.get_tenants() if remaining else [])
+        verb = self.verb_check(existing)
+        report, pending = [], []
+        for tenant_name in tenant_names:
+            status = {'name': tenant_name}
+            report.append(status)
+            if self.confirmed('tenant', tenant_name):
+                status['status'] = 'journaled'
+                continue
+            if self.resource_exists(existing, 'name', tenant_name)[0]:
+                status['status'] = 'exists'
+                continue
+            existing.add({'name': tenant_name})
+            pending.append((status, lambda verb, name=tenant_name:
+                            self._write_tenant(name, verb)))
+        self._apply_batch(pending, verb, max_concurrency)
+        return report
+
     def get_switches_standalone(self):
 
         uri = '/api/v1/data/controller/core/zerotouch/device'
@@ -119,13 +243,13 @@ class BigCloudFabric(object):
         temp = {}
         nodes = {}
         for each in r5:
-            if each.has_key('name'):
+            if 'name' in each:
                 key = each['name']
                 devices[key] = each
                 devices[key].pop('reload-pending')
                 devices[key].pop('dpid')
 
-                for k, v in devices[key].iteritems():
+                for k, v in devices[key].items():
                     k1 = str(k)
                     v1 = str(v)
                     temp[k1] = str(v1)
@@ -143,12 +267,18 @@ class BigCloudFabric(object):
         data = {}
         uri = '/api/v1/data/controller/applications/bcf/tenant[name="' + tenant_name + '"]'
         self.api_call(uri, 'DELETE', data)
+        if self.journal is not None:
+            # its segments and segment interfaces went with it
+            self.journal.forget(*[key for key in self.journal.keys()
+                                  if key[0] != 'switch' and key[1] == tenant_name])
         # print json.dumps( tenants, indent=4)
 
     def delete_segment(self, tenant_name, segment_name):
         data = {'name': segment_name}
         uri = '/api/v1/data/controller/applications/bcf/tenant[name="' + tenant_name + '"]/segment[name="%s"]' %segment_name
         self.api_call(uri, 'DELETE', data)
+        if self.journal is not None:
+            self.journal.forget(('segment', tenant_name, segment_name))
 
     def get_segments(self, tenant_name):
         uri = '/api/v1/data/controller/applications/bcf/tenant[name="' + tenant_name + '"]/segment'
@@ -157,44 +287,146 @@ class BigCloudFabric(object):
 
     def resource_exists(self, resource_list, key, value):
         '''
-        accept a list of dictionaries and searches
-        the list of dictionaries. if a key/value pair is found
-        return true, else return false
+        accept a list of dictionaries or a ResourceIndex and look up
+        the key/value pair. returns (True, resource) if found,
+        else (False, {})
         '''
-        exists = False, {}
-        for each in resource_list:
-            if each[key] == value:
-                exists = True, each
-        return exists
+        if not isinstance(resource_list, ResourceIndex):
+            resource_list = ResourceIndex(resource_list)
+        return resource_list.find(key, value)
 
     def create_segment(self, tenant_name, segment_name,
-                       vlan_id, port_group, interfaces, switch):
-        segments = self.get_segments(tenant_name)
+                       vlan_id, port_group, interfaces, switch,
+                       segments=None):
+        '''
+        segments: optional ResourceIndex of get_segments(tenant_name)
+        shared by many calls so the segment list is fetched once. without
+        it only the named segment is looked up
+        '''
+        if self.confirmed('segment', tenant_name, segment_name):
+            return False  # written by an earlier run
+        if segments is None:
+            uri = '/api/v1/data/controller/applications/bcf/tenant[name="' + tenant_name + '"]/segment[name="' + segment_name + '"]'
+            if self.get_resource(uri) is not None:
+                return False  # 'Segment already configured in controller'
+            self._write_segment(tenant_name, segment_name, vlan_id,
+                                port_group, interfaces, switch, 'PUT', uri)
+            return True
         verb = self.verb_check(segments)
 
         exists, dummy = self.resource_exists(segments, 'name', segment_name)
 
         if not exists:
-            data = {'name': segment_name}
+            self._write_segment(tenant_name, segment_name, vlan_id,
+                                port_group, interfaces, switch, verb)
+            segments.add({'name': segment_name})
+            return True
+        else:
+            return False  # 'Segment already configured in controller'
+
+    def _write_segment(self, tenant_name, segment_name, vlan_id,
+                       port_group, interfaces, switch, verb, uri=None):
+        self._journaled(('segment', tenant_name, segment_name), lambda: self._send_segment(
+            tenant_name, segment_name, vlan_id, port_group, interfaces, switch, verb, uri))
+
+    def _send_segment(self, tenant_name, segment_name, vlan_id,
+                      port_group, interfaces, switch, verb, uri=None):
+        # PUT of the segment itself creates it with both rules
+        data = {'name': segment_name,
+                'port-group-membership-rule': [{"vlan": vlan_id, "port-group": port_group}],
+                'switch-port-membership-rule': [{"vlan": vlan_id, "switch": switch,
+                                                 "interface": interfaces}]}
+        segment_uri = '/api/v1/data/controller/applications/bcf/tenant[name="' + tenant_name + '"]/segment[name="%s"]' %segment_name
+        if self._composed_write(segment_uri, 'PUT', data):
+            return
+
+        data = {'name': segment_name}
+        if uri is None:
             uri = '/api/v1/data/controller/applications/bcf/tenant[name="' + tenant_name + '"]/segment'
-            self.api_call(uri, verb, data)
+        self._write_call(uri, verb, data)
 
-            uri = '/api/v1/data/controller/applications/bcf/tenant[name="' + tenant_name + '"]/segment[name="%s"]/port-group-membership-rule' %segment_name
-            data = {"vlan": vlan_id, "port-group": port_group }
-            self.api_call(uri, verb, data)
+        uri = '/api/v1/data/controller/applications/bcf/tenant[name="' + tenant_name + '"]/segment[name="%s"]/port-group-membership-rule' %segment_name
+        data = {"vlan": vlan_id, "port-group": port_group }
+        self._write_call(uri, verb, data)
 
-            uri = '/api/v1/data/controller/applications/bcf/tenant[name="' + tenant_name + '"]/segment[name="%s"]/switch-port-membership-rule' %segment_name
-            data = {"vlan": vlan_id, "switch": switch, "interface": interfaces}
-            self.api_call(uri, verb, data)
-            return True
+        uri = '/api/v1/data/controller/applications/bcf/tenant[name="' + tenant_name + '"]/segment[name="%s"]/switch-port-membership-rule' %segment_name
+        data = {"vlan": vlan_id, "switch": switch, "interface": interfaces}
+        self._write_call(uri, verb, data)
+
+    def create_segments(self, tenant_name, segments, max_concurrency=8):
+        '''
+        create many segments of one tenant against a single fetch of its
+        segment list. segments is a list of dicts with the create_segment
+        arguments (segment_name, vlan_id, port_group, interfaces, switch).
+        returns one status dict per segment, in order
+        '''
+        remaining = [each for each in segments
+                     if not self.confirmed('segment', tenant_name, each['segment_name'])]
+        existing = ResourceIndex(self.get_segments(tenant_name) if remaining else [])
+        verb = self.verb_check(existing)
+        report, pending = [], []
+        for each in segments:
+            status = {'name': each['segment_name']}
+            report.append(status)
+            if self.confirmed('segment', tenant_name, each['segment_name']):
+                status['status'] = 'journaled'
+                continue
+            if self.resource_exists(existing, 'name', each['segment_name'])[0]:
+                status['status'] = 'exists'
+                continue
+            existing.add({'name': each['segment_name']})
+            pending.append((status, lambda verb, each=each: self._write_segment(
+                tenant_name, each['segment_name'], each['vlan_id'],
+                each['port_group'], each['interfaces'], each['switch'], verb)))
+        self._apply_batch(pending, verb, max_concurrency)
+        return report
+
+    def _apply_batch(self, pending, verb, max_concurrency):
+        '''
+        run the (status, write) pairs of a batch, at most max_concurrency
+        at a time, recording created or failed in each status. write(verb)
+        issues the REST calls for one item. when the collection was empty
+        (verb PUT) the first item is written alone and the rest POSTed
+        '''
+        if pending and verb == 'PUT':
+            self._apply_one(pending[0], verb)
+            pending = pending[1:]
+        workers = min(max(max_concurrency, 1), len(pending))
+        pending = iter(pending)
+        lock = threading.Lock()
+
+        def worker():
+            while True:
+                with lock:
+                    entry = next(pending, None)
+                if entry is None:
+                    return
+                self._apply_one(entry, 'POST')
+
+        threads = [threading.Thread(target=worker) for _ in range(workers)]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def _apply_one(self, entry, verb):
+        status, write = entry
+        try:
+            write(verb)
+        except Exception as exc:
+            status['status'] = 'failed'
+            status['error'] = str(exc)
         else:
-            return False  # 'Segment already configured in controller'
+            status['status'] = 'created'
 
     def delete_logical_segment_interface(self, tenant_name, segment):
 
         data = {}
-        uri = '/api/v1/data/controller/applications/bcf/tenant[name="' + tenant_name + '"]/logical-router/segment-interface[segment= "'+ segment +'"]'
+        uri = '/api/v1/data/controller/applications/bcf/tenant[name="' + tenant_name + '"]/logical-router/segment-interface[segment="' + segment + '"]'
         self.api_call(uri, 'DELETE', data)
+        if self.journal is not None:
+            self.journal.forget(('segment-interface', tenant_name, segment))
 
     def get_logical_interfaces(self, tenant_name):
         uri = '/api/v1/data/controller/applications/bcf/tenant[name="' + tenant_name + '"]/logical-router'
@@ -202,43 +434,79 @@ class BigCloudFabric(object):
         # returns a list of dictionaries - one dict per segment
         return logical_interfaces
 
-    def logical_interface_exist(self, tenant_name,
-                                logical_interfaces_in_tenant, segment):
-        match = False, {}
+    def segment_interfaces(self, logical_interfaces_in_tenant):
+        '''
+        index the segment-interfaces of every logical router returned by
+        get_logical_interfaces() by their segment. the routers themselves
+        are kept as .routers, which picks the verb of the router write
+        '''
+        interfaces = []
         for each in logical_interfaces_in_tenant:
-            for key, value in each.iteritems():
-                if key == 'segment-interface':
-                    for segment_interface in value:
-                        if segment == segment_interface['segment']:
-                            match = True, segment_interface
-        return match
+            interfaces.extend(each.get('segment-interface', []))
+        index = ResourceIndex(interfaces)
+        index.routers = list(logical_interfaces_in_tenant)
+        return index
 
-    def create_logical_segment_interface(self, tenant_name, segment, lr_ip):
+    def logical_interface_exist(self, tenant_name,
+                                logical_interfaces_in_tenant, segment):
+        if not isinstance(logical_interfaces_in_tenant, ResourceIndex):
+            logical_interfaces_in_tenant = self.segment_interfaces(
+                logical_interfaces_in_tenant)
+        return logical_interfaces_in_tenant.find('segment', segment)
 
-        logical_interfaces_in_tenant = self.get_logical_interfaces(tenant_name)
+    def create_logical_segment_interface(self, tenant_name, segment, lr_ip,
+                                         logical_interfaces=None):
+        '''
+        logical_interfaces: optional segment_interfaces() index for the
+        tenant shared by many calls so the logical router is fetched once
+        '''
+        if self.confirmed('segment-interface', tenant_name, segment):
+            return  # written by an earlier run
+        if logical_interfaces is None:
+            logical_interfaces = self.get_logical_interfaces(tenant_name)
+        if not isinstance(logical_interfaces, ResourceIndex):
+            logical_interfaces = self.segment_interfaces(logical_interfaces)
         # print json.dumps( lrs, indent=4)
-        verb = self.verb_check(logical_interfaces_in_tenant)
+        # PUT only creates the router when the tenant has none; once it
+        # exists a PUT would replace its configuration
+        verb = self.verb_check(logical_interfaces.routers)
         exists, config = self.logical_interface_exist(tenant_name,
-                                                      logical_interfaces_in_tenant,
+                                                      logical_interfaces,
                                                       segment)
 
         # keeping API calls separate to ease troubleshooting at this time
         if not exists:
-            data = {}
-            uri = '/api/v1/data/controller/applications/bcf/tenant[name="' + tenant_name + '"]/logical-router'
-            self.api_call(uri, verb, data)
-
-            data = {'segment': segment}
-            uri = '/api/v1/data/controller/applications/bcf/tenant[name="' + tenant_name + '"]/logical-router/segment-interface'
-            self.api_call(uri, verb, data)
-
-            data = {"ip-cidr": lr_ip, "private": "false"}
-            uri = '/api/v1/data/controller/applications/bcf/tenant[name="' + tenant_name + '"]/logical-router/segment-interface[segment= "'+ segment +'"]/ip-subnet'
-            self.api_call(uri, verb, data)
+            self._journaled(('segment-interface', tenant_name, segment),
+                            lambda: self._send_segment_interface(tenant_name, segment,
+                                                                 lr_ip, verb))
+            logical_interfaces.add({'segment': segment})
+            if not logical_interfaces.routers:
+                logical_interfaces.routers.append({})
         else:
             msg = 'Logical router interface for the segment already configured'
             # not being returned - can be used for tshooting
 
+    def _send_segment_interface(self, tenant_name, segment, lr_ip, verb):
+        # PATCH merges the interface into the logical router, creating the
+        # router if needed, without touching its other interfaces
+        data = {'segment-interface': [{'segment': segment,
+                                       'ip-subnet': [{"ip-cidr": lr_ip, "private": "false"}]}]}
+        uri = '/api/v1/data/controller/applications/bcf/tenant[name="' + tenant_name + '"]/logical-router'
+        if self._composed_write(uri, 'PATCH', data):
+            return
+
+        data = {}
+        uri = '/api/v1/data/controller/applications/bcf/tenant[name="' + tenant_name + '"]/logical-router'
+        self._write_call(uri, verb, data)
+
+        data = {'segment': segment}
+        uri = '/api/v1/data/controller/applications/bcf/tenant[name="' + tenant_name + '"]/logical-router/segment-interface'
+        self._write_call(uri, verb, data)
+
+        data = {"ip-cidr": lr_ip, "private": "false"}
+        uri = '/api/v1/data/controller/applications/bcf/tenant[name="' + tenant_name + '"]/logical-router/segment-interface[segment="' + segment + '"]/ip-subnet'
+        self._write_call(uri, verb, data)
+
     def verb_check(self, resource_list):
         if len(resource_list) == 0:
             return 'PUT'
@@ -256,7 +524,7 @@ class BigCloudFabric(object):
         uri = '/api/v1/data/controller/cluster'
         r2 = self.get_api_call(uri, 'GET')[0]
         cluster_name = r2['name']
-        if r2.has_key('description'):
+        if 'description' in r2:
             description = r2['description']
         else:
             description = 'None set (null)'
@@ -275,7 +543,7 @@ class BigCloudFabric(object):
             controllers[key] = each
             controllers[key].pop('node-id')
 
-            for k, v in controllers[key].iteritems():
+            for k, v in controllers[key].items():
                 k1 = str(k)
                 v1 = str(v)
                 temp[k1] = str(v1)
@@ -306,7 +574,7 @@ class BigCloudFabric(object):
         local_hostname = r6['network']['hostname']
 
         path = r6['network']['interface'][0]['ipv4']['dns']
-        if path.has_key('search-path'):
+        if 'search-path' in path:
             if len(path['search-path']) == 1:
                 domain = path['search-path'][0]
             else:
@@ -316,7 +584,7 @@ class BigCloudFabric(object):
 
         uri = '/api/v1/data/controller/os/config/global/virtual-ip'
         r7 = self.get_api_call(uri, 'GET')[0]
-        if r7.has_key('ipv4-address'):
+        if 'ipv4-address' in r7:
             vip = r7['ipv4-address']
         else:
             vip = 'None_set_(null)'
@@ -338,6 +606,125 @@ class BigCloudFabric(object):
         return facts
 
 
+class ResourceIndex(object):
+    '''
+    lookup view over a list of resource dictionaries as returned by the
+    get_* methods. one dict per key field (name, segment, ...) is built
+    the first time that field is searched, so existence checks against
+    the same fetch cost O(1) instead of a scan of the whole list
+    '''
+
+    def __init__(self, resources):
+        self.resources = list(resources)
+        self._indexes = {}
+
+    def __len__(self):
+        return len(self.resources)
+
+    def __iter__(self):
+        return iter(self.resources)
+
+    def _index(self, key):
+        if key not in self._indexes:
+            index = {}
+            for each in self.resources:
+                if key in each:
+                    index[each[key]] = each
+            self._indexes[key] = index
+        return self._indexes[key]
+
+    def find(self, key, value):
+        resource = self._index(key).get(value)
+        if resource is None:
+            return False, {}
+        return True, resource
+
+    def add(self, resource):
+        '''
+        record a resource created after the fetch so later checks see it
+        '''
+        self.resources.append(resource)
+        for key, index in self._indexes.items():
+            if key in resource:
+                index[resource[key]] = resource
+
+
+class Journal(object):
+    '''
+    append-only record of provisioning writes, one json line per event.
+    an item, keyed like ('segment', tenant, segment), gets a begin line
+    before its REST calls and a commit line with their response statuses
+    once all of them succeeded; the commit is synced to disk before the
+    next item. a run given the journal of an earlier one skips the
+    committed items, so resuming after a failure only checks and writes
+    what is left. an item deleted through the client is forgotten; one
+    changed on the controller by other means is not, so remove the file
+    once the batch it resumes is done
+    '''
+
+    def __init__(self, path):
+        self.path = os.path.expanduser(path)
+        self._lock = threading.Lock()
+        self._committed = {}
+        # a line cut short by a crash while writing is skipped, and the
+        # next entry starts on a line of its own
+        self._partial = False
+        try:
+            with open(self.path) as journal_file:
+                for line in journal_file:
+                    self._partial = not line.endswith('\n')
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    key = tuple(entry['key'])
+                    if entry['event'] == 'commit':
+                        self._committed[key] = entry
+                    elif entry['event'] == 'forget':
+                        self._committed.pop(key, None)
+        except IOError:
+            pass
+
+    def _append(self, event, key, sync=False, **extra):
+        entry = dict(extra, event=event, key=list(key), time=round(time.time(), 3))
+        line = json.dumps(entry) + '\n'
+        with self._lock:
+            if self._partial:
+                line = '\n' + line
+                self._partial = False
+        # one write of the whole line on an O_APPEND descriptor, so lines
+        # of threads or processes sharing the journal do not interleave
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+        try:
+            os.write(fd, line.encode('utf-8'))
+            if sync:
+                os.fsync(fd)
+        finally:
+            os.close(fd)
+        return entry
+
+    def confirmed(self, key):
+        return tuple(key) in self._committed
+
+    def keys(self):
+        with self._lock:
+            return list(self._committed)
+
+    def begin(self, key):
+        self._append('begin', key)
+
+    def commit(self, key, statuses):
+        entry = self._append('commit', key, sync=True, status=statuses)
+        with self._lock:
+            self._committed[tuple(key)] = entry
+
+    def forget(self, *keys):
+        for key in keys:
+            self._append('forget', key, sync=True)
+            with self._lock:
+                self._committed.pop(tuple(key), None)
+
+
 def main():
 
     fab = BigCloudFabric(controller_ip='52.91.237.106',
@@ -347,8 +734,8 @@ def main():
     # ## GET FACTS  ###
     ##################
     facts = fab.facts()
-    print json.dumps(facts, indent=4)
-    print '=' * 50
+    print(json.dumps(facts, indent=4))
+    print('=' * 50)
     '''
     #########################
     # ## PROVISION LEAF1  ###
@@ -389,7 +776,7 @@ def main():
     port_group = 'any'
     interfaces = 'any'
     switch = 'any'
-    print 'hhhhhhhhhhhhhhhhhhhh'
+    print('hhhhhhhhhhhhhhhhhhhh')
     fab.create_segment(tenant_name, segment_name, vlan_id,
                        port_group, interfaces, switch)
 
@@ -410,7 +797,7 @@ def main():
     ######################
     ### DELETE TENANT  ###
     ######################
-    print 'NOW!!!!!!!!!!'
+    print('NOW!!!!!!!!!!')
     import time
     time.sleep(8)
     tenant_name = 'tenant_B'
@@ -419,7 +806,7 @@ def main():
     ######################
     ### DELETE SEGMENT  ###
     ######################
-    print 'NOW!!!!!!!!!!'
+    print('NOW!!!!!!!!!!')
     #time.sleep(15)
     tenant_name = 'tenant_A'
     segment_name = 'web'
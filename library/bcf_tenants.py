@@ -0,0 +1,284 @@
+#!/usr/bin/env python
+
+# Copyright 2016 Jason Edelman <jason@networktocode.com>
+# Network to Code, LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+DOCUMENTATION = '''
+---
+module: bcf_tenants
+short_description: Declarative tenant configuration of a Big Switch Big Cloud Fabric
+description:
+    - Reconcile BCF tenants, their segments, segment membership rules and
+      logical router segment interfaces with a desired state. The current
+      tenant tree is fetched once, the difference is computed locally and
+      only the REST calls needed to close it are sent, deletions before
+      creations and parents before children.
+    - These options of bcf_get_facts are accepted as well, with the same
+      meaning and defaults - pool_size, keepalive, connect_timeout,
+      read_timeout, cookie_cache, cookie_cache_ttl, cache_dir,
+      flush_cookie_cache, retries, retry_backoff, circuit_breaker,
+      circuit_breaker_threshold, circuit_breaker_cooldown, rate_limit,
+      rate_burst and max_in_flight. The tenant tree is always read from
+      the controller, so response_cache and broker are not.
+author: Jason Edelman (@jedelman8)
+version_added: 1.9.2
+options:
+    controller:
+        description:
+            - Hostame or IP address of BCF controller.
+        required: true
+    username:
+        description:
+            - Username used to login to the controller
+        required: true
+    password:
+        description:
+            - Password used to login to the controller
+        required: true
+    tenants:
+        description:
+            - Desired tenants. Each entry has a name and optionally
+              segments (name, port_group_rules, switch_port_rules) and
+              segment_interfaces (segment, ip_subnets) for the tenant's
+              logical router. Rules are dicts of controller field names.
+        required: true
+    purge:
+        description:
+            - Delete tenants, and segments, rules, segment interfaces and
+              subnets of the listed tenants, that are not in the desired state
+        required: false
+        default: false
+        choices: [true, false]
+'''
+
+EXAMPLES = '''
+- bcf_tenants:
+    controller: 10.1.1.100
+    username: admin
+    password: bsn123
+    tenants:
+      - name: tenant_A
+        segments:
+          - name: web
+            port_group_rules:
+              - {port-group: any, vlan: 1000}
+            switch_port_rules:
+              - {switch: any, interface: any, vlan: 1000}
+        segment_interfaces:
+          - segment: web
+            ip_subnets: [10.1.1.1/24]
+
+'''
+
+RETURN = '''
+operations:
+    description: REST calls sent (or, in check mode, that would be sent)
+    returned: always
+    type: list
+    sample:
+        "operations": [
+            {
+                "verb": "PUT",
+                "uri": "/api/v1/data/controller/applications/bcf/tenant[name=\\"tenant_A\\"]",
+                "data": {"name": "tenant_A"}
+            }
+        ]
+'''
+
+from ansible.module_utils.bsn import (BigSwitchClient, RequestException,
+                                      client_argument_spec, client_kwargs)
+
+TENANT_URI = '/api/v1/data/controller/applications/bcf/tenant'
+
+RULE_TYPES = (('port_group_rules', 'port-group-membership-rule'),
+              ('switch_port_rules', 'switch-port-membership-rule'))
+
+# client options left out: the plan has to start from the tenant tree the
+# controller holds now, not from an answer the broker or the response
+# cache kept, and the tree is a single GET
+EXCLUDED_OPTIONS = ('response_cache', 'broker', 'broker_ttl', 'max_concurrency')
+
+
+def predicate(resource):
+    '''
+    BigDB path predicate selecting resource by all of its fields
+    '''
+    return ''.join('[%s="%s"]' % (key, resource[key]) for key in sorted(resource))
+
+
+def rule_matches(wanted, rule):
+    return all(str(rule.get(key)) == str(value) for key, value in wanted.items())
+
+
+def normalize_desired(tenants):
+    '''
+    tenants option -> {tenant: {'segments': {name: {rule type: [rules]}},
+    'interfaces': {segment: [cidrs]}}}
+    '''
+    state = {}
+    for tenant in tenants:
+        segments = {}
+        for segment in tenant.get('segments') or []:
+            segments[segment['name']] = dict(
+                (rule_type, list(segment.get(option) or []))
+                for option, rule_type in RULE_TYPES)
+        interfaces = {}
+        for interface in tenant.get('segment_interfaces') or []:
+            interfaces[interface['segment']] = list(interface.get('ip_subnets') or [])
+        state[tenant['name']] = dict(segments=segments, interfaces=interfaces)
+    return state
+
+
+def normalize_current(tenant_list):
+    '''
+    GET of the tenant list -> same layout as normalize_desired, plus
+    whether each tenant already has a logical router
+    '''
+    state = {}
+    for tenant in tenant_list:
+        segments = {}
+        for segment in tenant.get('segment') or []:
+            segments[segment['name']] = dict(
+                (rule_type, list(segment.get(rule_type) or []))
+                for _, rule_type in RULE_TYPES)
+        router = tenant.get('logical-router')
+        if isinstance(router, list):
+            router = router[0] if router else None
+        interfaces = {}
+        for interface in (router or {}).get('segment-interface') or []:
+            interfaces[interface['segment']] = [
+                subnet['ip-cidr'] for subnet in interface.get('ip-subnet') or []]
+        state[tenant['name']] = dict(segments=segments, interfaces=interfaces,
+                                     router=router is not None)
+    return state
+
+
+def plan(current, desired, purge=False):
+    '''
+    ordered (verb, uri, data) operations turning current into desired.
+    deletions come first and children before parents, so a segment is
+    only removed once the interfaces using it are gone; creations follow
+    parents first. a deleted parent takes its subtree with it, so no
+    calls are planned for the children of a deleted tenant or segment
+    '''
+    deletes, creates = [], []
+
+    for tenant_name in sorted(current) if purge else []:
+        tenant_uri = TENANT_URI + '[name="%s"]' % tenant_name
+        if tenant_name not in desired:
+            deletes.append((3, 'DELETE', tenant_uri, None))
+            continue
+        have = current[tenant_name]
+        want = desired[tenant_name]
+        for segment, cidrs in sorted(have['interfaces'].items()):
+            interface_uri = (tenant_uri + '/logical-router/segment-interface[segment="%s"]'
+                             % segment)
+            if segment not in want['interfaces']:
+                deletes.append((0, 'DELETE', interface_uri, None))
+                continue
+            for cidr in cidrs:
+                if cidr not in want['interfaces'][segment]:
+                    deletes.append((0, 'DELETE', interface_uri + '/ip-subnet[ip-cidr="%s"]' % cidr, None))
+        for segment_name, rules in sorted(have['segments'].items()):
+            segment_uri = tenant_uri + '/segment[name="%s"]' % segment_name
+            if segment_name not in want['segments']:
+                deletes.append((2, 'DELETE', segment_uri, None))
+                continue
+            for _, rule_type in RULE_TYPES:
+                wanted = want['segments'][segment_name][rule_type]
+                for rule in rules[rule_type]:
+                    if not any(rule_matches(each, rule) for each in wanted):
+                        deletes.append((1, 'DELETE', segment_uri + '/' + rule_type + predicate(rule), None))
+
+    for tenant_name in sorted(desired):
+        want = desired[tenant_name]
+        have = current.get(tenant_name, dict(segments={}, interfaces={}, router=False))
+        tenant_uri = TENANT_URI + '[name="%s"]' % tenant_name
+        if tenant_name not in current:
+            creates.append((0, 'PUT', tenant_uri, {'name': tenant_name}))
+        for segment_name, rules in sorted(want['segments'].items()):
+            segment_uri = tenant_uri + '/segment[name="%s"]' % segment_name
+            existing = have['segments'].get(segment_name)
+            if existing is None:
+                creates.append((1, 'PUT', segment_uri, {'name': segment_name}))
+                existing = dict((rule_type, []) for _, rule_type in RULE_TYPES)
+            for _, rule_type in RULE_TYPES:
+                for rule in rules[rule_type]:
+                    if not any(rule_matches(rule, each) for each in existing[rule_type]):
+                        creates.append((2, 'POST', segment_uri + '/' + rule_type, rule))
+        if want['interfaces'] and not have['router']:
+            creates.append((3, 'PUT', tenant_uri + '/logical-router', {}))
+        for segment, cidrs in sorted(want['interfaces'].items()):
+            interface_uri = (tenant_uri + '/logical-router/segment-interface[segment="%s"]'
+                             % segment)
+            existing = have['interfaces'].get(segment)
+            if existing is None:
+                creates.append((4, 'PUT', interface_uri, {'segment': segment}))
+                existing = []
+            for cidr in cidrs:
+                if cidr not in existing:
+                    creates.append((5, 'POST', interface_uri + '/ip-subnet',
+                                    {'ip-cidr': cidr, 'private': 'false'}))
+
+    # stable sorts keep tenant order inside each dependency level
+    deletes.sort(key=lambda op: op[0])
+    creates.sort(key=lambda op: op[0])
+    return [op[1:] for op in deletes + creates]
+
+
+def main():
+    argument_spec = client_argument_spec(username=dict(required=True),
+                                         password=dict(required=True, no_log=True))
+    for name in EXCLUDED_OPTIONS:
+        del argument_spec[name]
+    argument_spec.update(
+        controller=dict(required=True),
+        tenants=dict(type='list', required=True),
+        purge=dict(type='bool', default=False),
+    )
+    module = AnsibleModule(
+        argument_spec=argument_spec,
+        supports_check_mode=True
+    )
+
+    try:
+        desired = normalize_desired(module.params['tenants'])
+    except (KeyError, TypeError) as exc:
+        module.fail_json(msg='invalid tenant definition: %s' % exc)
+
+    try:
+        fabric = BigSwitchClient(**client_kwargs(module.params,
+                                                 controller_ip=module.params['controller']))
+        current = normalize_current(fabric.api_call(TENANT_URI + '?config=true') or [])
+    except RequestException as exc:
+        module.fail_json(msg='%s: %s' % (module.params['controller'], exc))
+
+    operations = plan(current, desired, module.params['purge'])
+    result = [dict(verb=verb, uri=uri, data=data) for verb, uri, data in operations]
+
+    if not module.check_mode:
+        for index, (verb, uri, data) in enumerate(operations):
+            try:
+                fabric.api_call(uri, verb, data)
+            except RequestException as exc:
+                module.fail_json(msg='%s %s failed: %s' % (verb, uri, exc),
+                                 operations=result[:index])
+
+    module.exit_json(changed=bool(operations), operations=result)
+
+
+from ansible.module_utils.basic import *
+if __name__ == '__main__':
+    main()
@@ -27,20 +27,227 @@ options:
     controller:
         description:
             - Hostame or IP address of BCF controller.
-        required: true
+              Either controller or controllers is required, unless the
+              task runs with connection httpapi (see the bsn httpapi
+              plugin); the calls then go to the connection's controller
+              over its persistent, logged in session.
+        required: false
+    controllers:
+        description:
+            - List of BMF controllers to gather facts from concurrently in
+              this one task, all with the same credentials and options.
+              Facts are returned in bsnbmf_controllers keyed by
+              controller, each with its own error and elapsed time; the
+              task only fails when no controller answered. facts_cache
+              applies to each controller, stale_while_revalidate does not.
+        required: false
+    controller_concurrency:
+        description:
+            - Number of controllers gathered in parallel when controllers
+              is used
+        required: false
+        default: 8
     username:
         description:
-            - Username used to login to the controller
-        required: true
+            - Username used to login to the controller. Required unless
+              the task runs with connection httpapi.
+        required: false
     password:
         description:
-            - Password used to login to the controller
-        required: true
+            - Password used to login to the controller. Required unless
+              the task runs with connection httpapi.
+        required: false
+    pool_size:
+        description:
+            - Maximum number of connections kept open to the controller
+        required: false
+        default: 10
+    keepalive:
+        description:
+            - Reuse connections to the controller across REST calls
+        required: false
+        default: true
+        choices: [true, false]
+    connect_timeout:
+        description:
+            - Seconds to wait for a connection to the controller
+        required: false
+        default: 10
+    read_timeout:
+        description:
+            - Seconds to wait for the controller to answer a REST call
+        required: false
+        default: 60
+    max_concurrency:
+        description:
+            - Number of independent REST calls issued in parallel while
+              gathering facts. 1 issues them one after another.
+        required: false
+        default: 1
+    gather_subset:
+        description:
+            - Fact sections to collect, any of version, hostname, cluster,
+              nodes and summary, or all. Prefix a section with ! to skip
+              it. Only the REST calls the selected sections need are made.
+        required: false
+        default: ['all']
+    cookie_cache:
+        description:
+            - Keep the controller session cookie on disk, keyed by
+              controller and username, so later tasks skip the login.
+              A cookie the controller rejects triggers a fresh login.
+        required: false
+        default: false
+        choices: [true, false]
+    cookie_cache_ttl:
+        description:
+            - Seconds a cached session cookie is reused before logging in again
+        required: false
+        default: 900
+    cache_dir:
+        description:
+            - Directory holding the on-disk caches, created with mode 0700
+        required: false
+        default: ~/.ansible/bsn_cache
+    flush_cookie_cache:
+        description:
+            - Drop the cached session cookie for this controller and
+              username before running
+        required: false
+        default: false
+        choices: [true, false]
+    facts_cache:
+        description:
+            - Keep the gathered facts on disk, keyed by controller and
+              gather_subset, and serve them without contacting the
+              controller while they are younger than facts_cache_ttl
+        required: false
+        default: false
+        choices: [true, false]
+    facts_cache_ttl:
+        description:
+            - Seconds cached facts are served as fresh
+        required: false
+        default: 300
+    stale_while_revalidate:
+        description:
+            - Seconds past facts_cache_ttl during which the cached facts
+              are still returned immediately while a background process
+              gathers fresh ones for the next run. Runs that start while a
+              refresh is underway return the cached facts as well.
+        required: false
+        default: 0
+    response_cache:
+        description:
+            - Keep the ETag, Last-Modified and body hash of every fact
+              GET, and the facts built from it, in cache_dir. The next run
+              asks the controller for changes only when it sends an ETag
+              or Last-Modified, and reuses the facts of endpoints whose
+              response did not change instead of decoding them again.
+        required: false
+        default: false
+        choices: [true, false]
+    facts_delta:
+        description:
+            - Keep the facts of each run in cache_dir and, instead of the
+              facts, return what changed since the previous run in
+              bsnbmf_delta. changed is true when the fabric drifted. The
+              first run reports every node as added.
+        required: false
+        default: false
+        choices: [true, false]
+    profile:
+        description:
+            - Time every REST call (dns, connect, tls, time to first byte,
+              total, response bytes and json decode) and return the
+              timings in bsn_timings
+        required: false
+        default: false
+        choices: [true, false]
+    trace_file:
+        description:
+            - File the timed REST calls are appended to, one json object
+              per line tagged with the controller. Implies profile.
+        required: false
+    retries:
+        description:
+            - Times a REST call that timed out, could not connect or got
+              a 502, 503 or 504 is repeated. Only GET, PUT, DELETE and the
+              login are repeated.
+        required: false
+        default: 2
+    retry_backoff:
+        description:
+            - Seconds of the first pause between retries; it doubles on
+              every retry and a random part of it is used (full jitter)
+        required: false
+        default: 0.5
+    circuit_breaker:
+        description:
+            - Remember failures per controller in cache_dir, across tasks
+              and forks. Once circuit_breaker_threshold calls in a row
+              failed, calls to that controller fail immediately until
+              circuit_breaker_cooldown seconds passed since the last failure.
+        required: false
+        default: false
+        choices: [true, false]
+    circuit_breaker_threshold:
+        description:
+            - Failed calls in a row that open the circuit breaker
+        required: false
+        default: 3
+    circuit_breaker_cooldown:
+        description:
+            - Seconds the circuit breaker stays open
+        required: false
+        default: 60
+    rate_limit:
+        description:
+            - REST calls per second allowed to each controller, shared by
+              every fork on the Ansible host through cache_dir. Defaults
+              to the BSN_RATE_LIMIT environment variable; 0 disables it.
+        required: false
+    rate_burst:
+        description:
+            - Calls that may go out at once before rate_limit applies.
+              Defaults to BSN_RATE_BURST, else to rate_limit.
+        required: false
+    max_in_flight:
+        description:
+            - Calls the task has open to each controller at any time;
+              waiting GETs are sent before waiting writes. Defaults to the
+              BSN_MAX_IN_FLIGHT environment variable; 0 disables it.
+        required: false
+    broker:
+        description:
+            - Send the REST calls through a request broker on the host the
+              module runs on, started by the first task that needs it and
+              listening on a unix socket in cache_dir. The broker stays
+              logged in, sends identical GETs of tasks running at once as
+              one request and reuses GET responses for broker_ttl seconds,
+              so forks gathering from the same controller share their
+              calls. It exits after two minutes without a request.
+        required: false
+        default: false
+        choices: [true, false]
+    broker_ttl:
+        description:
+            - Seconds a GET response the broker received may be reused
+        required: false
+        default: 5
 '''
 
 EXAMPLES = '''
 - bmf_get_facts: controller=10.1.1.100 username=admin password=bsn123
 
+- bmf_get_facts: controller=10.1.1.100 username=admin password=bsn123 gather_subset=summary
+
+- bmf_get_facts:
+    controllers: "{{ groups['bmf'] }}"
+    username: admin
+    password: bsn123
+  run_once: true
+
 '''
 
 RETURN = '''
@@ -90,67 +297,95 @@ bsnbmf:
             "cluster": "N/A",
             "version": "N/A"
         }
+bsnbmf_delta:
+    description: Changes since the previous run. fabric_nodes lists the
+        nodes added, removed and changed (by dpid), summary the counters
+        that changed and facts any other value that changed, each as old
+        and new; see bcf_get_facts for the layout. Empty when nothing
+        changed.
+    returned: when facts_delta is true
+    type: dictionary
+    sample:
+        "bsnbmf_delta": {
+            "summary": {
+                "active_policies": {"old": 0, "new": 1}
+            }
+        }
+bsn_connection:
+    description: Connection reuse statistics for the REST calls made;
+        see bcf_get_facts for the layout
+    returned: when the controller was queried
+    type: dictionary
+bsn_facts_cache:
+    description: Whether the facts came from the cache (hit), from an
+        expired cache entry being refreshed in the background (stale) or
+        from the controller (miss), and their age in seconds
+    returned: when facts_cache is true
+    type: dictionary
+    sample:
+        "bsn_facts_cache": {
+            "status": "hit",
+            "age": 42.7
+        }
+bsn_timings:
+    description: Timings of each REST call in seconds, and per endpoint
+        the number of calls, total and slowest time and bytes received,
+        slowest endpoint first; see bcf_get_facts for the layout
+    returned: when profile is true
+    type: dictionary
+bsnbmf_controllers:
+    description: Facts of each controller, keyed by controller, with the
+        error that prevented gathering them, the seconds it took and,
+        with profile, its timings. With facts_delta the facts are
+        replaced by delta, laid out like bsnbmf_delta, and the result is
+        not set as a fact.
+    returned: when controllers is used
+    type: dictionary
+    sample:
+        "bsnbmf_controllers": {
+            "10.1.1.100": {
+                "facts": {"version": "N/A"},
+                "error": null,
+                "elapsed": 0.4211
+            }
+        }
 
 '''
 
 import json
-import requests
-
-requests.packages.urllib3.disable_warnings()
-
-
-class BigCloudFabric(object):
-
-    def __init__(self,
-                 username='admin',
-                 password='bsn123',
-                 controller_ip='192.168.200.102',
-                 port='8082',
-                 protocol='http'):
-
-        self.username = username
-        self.password = password
-        self.controller_ip = controller_ip
-        self.port = port
-        self.protocol = protocol
-        self.base_url = self.protocol + '://' + self.controller_ip + ':' + self.port
-        self.session_cookie = self.get_session_cookie()
-
-    def get_session_cookie(self):
-        url = self.base_url + '/auth/login'
-        data = {"password": self.password, "user": self.username}
-        rsp = requests.post(url, json.dumps(data), verify=False)
-        return rsp.cookies
-
-    def _make_request(self):
-        # params = dict(cookies=self.session_cookie, verify=False)
-        params = dict(verify=False)
-        cookies = dict(session_cookie=self.session_cookie['session_cookie'])
-        params['cookies'] = cookies
-        if self.verb == 'GET':
-            rsp = requests.get(self.url, self.data, **params)
-        elif self.verb == 'PUT':
-            rsp = requests.put(self.url, self.data, **params)
-        elif self.verb == 'POST':
-            rsp = requests.post(self.url, self.data, **params)
-        return rsp
-
-    def _execute(self):
-        if not self.session_cookie:
-            self.session_cookie = self.get_session_cookie()
-        response = self._make_request()
-
-        return response
-
-    def api_call(self, uri, verb='GET', data={}):
-
-        self.url = self.protocol + '://' + self.controller_ip + ':' + self.port + uri
-        self.data = json.dumps(data)
-        self.verb = verb
-        output = self._execute()
-        # print output.text
-        json_out = json.loads(output.text)
-        return json_out
+from ansible.module_utils.bsn import (BigSwitchClient, parse_gather_subset,
+                                      facts_argument_spec, run_facts_module)
+
+# bump when the layout of the facts dict changes so cached facts and
+# snapshots written by an older module are not used
+FACTS_CACHE_FORMAT = '1'
+
+
+class BigCloudFabric(BigSwitchClient):
+
+    PROFILE = 'bmf'
+    FACTS_FORMAT = FACTS_CACHE_FORMAT
+
+    # independent GETs behind facts(), issued together by api_calls()
+    FACT_URIS = dict(
+        fabric_nodes='/api/v1/data/controller/core/switch',
+        summary='/api/v1/data/controller/applications/bigtap/info',
+    )
+
+    # the only fields build_nodes reads of each switch
+    FACT_FIELDS = dict(
+        fabric_nodes=['alias', 'dpid', 'attributes.description-data'],
+    )
+
+    # gather_subset sections and the FACT_URIS each of them needs; the
+    # version, cluster and hostname facts are not exposed by BMF yet
+    SUBSETS = dict(
+        version=[],
+        hostname=[],
+        cluster=[],
+        nodes=['fabric_nodes'],
+        summary=['summary'],
+    )
 
     def _verb_check(self, resource_list):
         if len(resource_list) == 0:
@@ -158,7 +393,7 @@ class BigCloudFabric(object):
         else:
             return 'POST'
 
-    def facts(self):
+    def facts(self, gather_subset=None):
 
         # GET VERSION
         """
@@ -169,21 +404,29 @@ class BigCloudFabric(object):
 
         uri = '/rest/v1/system/version' # DOESN'T WORK
 
-        uri = '/api/v1/data/controller/core/switch'
-        node_info = self.api_call(uri, 'GET')
+        subset = parse_gather_subset(gather_subset, self.SUBSETS)
+
+        facts = {}
+        facts['vendor'] = 'big_switch_networks'
+        for section in self.gather_sections(subset).values():
+            facts.update(section)
+        return facts
+
+    def build_nodes(self, rsp):
         nodes = []
-        for each in node_info:
+        for each in rsp['fabric_nodes']:
             temp = {}
             temp['alias'] = each.get('alias')
             temp['dpid'] = each.get('dpid')
             temp['serial_number'] = each.get('attributes').get('description-data').get('serial-number')
             temp['sw'] = each.get('attributes').get('description-data').get('software-description')
             nodes.append(temp)
+        return dict(fabric_nodes=nodes)
 
-        uri = '/api/v1/data/controller/applications/bigtap/info'
-        fabric_summary = self.api_call(uri, 'GET')[0]
+    def build_summary(self, rsp):
+        fabric_summary = rsp['summary'][0]
 
-        summary = dict(
+        return dict(summary=dict(
             total_switches=fabric_summary.get('num-total-switches'),
             match_mode=fabric_summary.get('match-mode'),
             num_services=fabric_summary.get('num-services'),
@@ -196,42 +439,25 @@ class BigCloudFabric(object):
             delivery_interfaces=fabric_summary.get("num-delivery-interfaces" ),
             service_interfaces=fabric_summary.get("num-service-interfaces" ),
             filter_interfaces=fabric_summary.get("num-filter-interfaces" ),
-            )
+            ))
 
+    def build_cluster(self, rsp):
+        return dict(cluster='N/A')
 
-        facts = {}
-        facts['cluster'] = 'N/A'
-        facts['fabric_nodes'] = nodes
-        facts['vendor'] = 'big_switch_networks'
-        facts['summary'] = summary
-        facts['version'] = 'N/A'
-        facts['platform'] = 'N/A'
-        facts['hostname'] = 'N/A'
+    def build_version(self, rsp):
+        return dict(version='N/A', platform='N/A')
 
-        return facts
+    def build_hostname(self, rsp):
+        return dict(hostname='N/A')
 
 
 def main():
     module = AnsibleModule(
-        argument_spec=dict(
-            controller=dict(required=True),
-            username=dict(required=True),
-            password=dict(required=True),
-        ),
+        argument_spec=facts_argument_spec(),
+        mutually_exclusive=[['controller', 'controllers']],
         supports_check_mode=False
     )
-
-    controller = module.params['controller']
-    username = module.params['username']
-    password = module.params['password']
-
-    fabric = BigCloudFabric(controller_ip=controller,
-                            username=username,
-                            password=password)
-
-    facts = fabric.facts()
-
-    module.exit_json(ansible_facts=dict(bsnbmf=facts))
+    run_facts_module(module, BigCloudFabric, 'bsnbmf')
 
 
 def test():
@@ -245,7 +471,7 @@ def test():
 
     facts = fabric.facts()
 
-    print json.dumps(facts, indent=4)
+    print(json.dumps(facts, indent=4))
 
 
 from ansible.module_utils.basic import *
@@ -0,0 +1,1637 @@
+# Copyright 2016 Jason Edelman <jason@networktocode.com>
+# Network to Code, LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+REST client shared by the Big Switch modules. Ansible ships this file
+with any module that imports ansible.module_utils.bsn when it sits in a
+module_utils directory next to the playbook or library.
+'''
+
+import os
+import json
+import time
+import codecs
+import errno
+import fcntl
+import random
+import socket
+import hashlib
+import tempfile
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from requests.exceptions import RequestException
+from requests.structures import CaseInsensitiveDict
+from requests.packages.urllib3.connection import HTTPConnection, HTTPSConnection
+from requests.packages.urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from requests.packages.urllib3.exceptions import NewConnectionError, ConnectTimeoutError
+from ansible.module_utils.connection import Connection, ConnectionError
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+try:
+    import SocketServer as socketserver
+except ImportError:
+    import socketserver
+
+requests.packages.urllib3.disable_warnings()
+
+# transport defaults and login endpoint of each controller type
+PROFILES = dict(
+    bcf=dict(protocol='https', port='8443', login='/api/v1/auth/login'),
+    bmf=dict(protocol='http', port='8082', login='/auth/login'),
+)
+
+# verbs safe to send again when the first attempt may have reached the
+# controller, and the answers of an overloaded or restarting controller
+IDEMPOTENT_VERBS = ('GET', 'HEAD', 'PUT', 'DELETE')
+RETRY_STATUS = (502, 503, 504)
+# answers to a session cookie the controller no longer accepts
+AUTH_STATUS = (401, 403)
+
+# bytes read at a time when a response is decoded while it streams in
+STREAM_CHUNK = 64 * 1024
+
+# seconds a request broker keeps running without a request
+BROKER_IDLE = 120
+
+
+class BigSwitchError(RequestException):
+    '''
+    a call refused by the client itself, e.g. while the circuit breaker
+    of its controller is open
+    '''
+
+
+# timing dict of the call running on this thread, filled in by the
+# connection classes below, and whether its client is profiling
+_trace = threading.local()
+
+
+def _timing():
+    return getattr(_trace, 'timing', None)
+
+
+class _TimedConnection(object):
+    '''
+    records into the timing of the call running on this thread whether it
+    opened a connection, and for profiling clients the dns, connect and
+    time to first byte
+    '''
+
+    def _new_conn(self):
+        timing = _timing()
+        if timing is None:
+            return super(_TimedConnection, self)._new_conn()
+        start = time.time()
+        addresses = []
+        if getattr(_trace, 'profile', False) and hasattr(self, '_dns_host'):
+            try:
+                addresses = [info[4][0] for info in socket.getaddrinfo(
+                    self._dns_host, self.port, 0, socket.SOCK_STREAM)]
+            except socket.error:
+                # urllib3 resolves the name itself and reports the error
+                pass
+        resolved = time.time()
+        conn = self._connect_to(addresses)
+        timing['_ready'] = time.time()
+        timing['dns'] = round(resolved - start, 4)
+        timing['connect'] = round(timing['_ready'] - resolved, 4)
+        return conn
+
+    def _connect_to(self, addresses):
+        '''
+        open the socket to the first of the addresses already resolved that
+        accepts it, so urllib3 does not look the name up again. without
+        addresses urllib3 resolves the host and connect includes the dns time
+        '''
+        if not addresses:
+            return super(_TimedConnection, self)._new_conn()
+        # host reads _dns_host, it is back before the tls handshake uses it
+        dns_host = self._dns_host
+        for address in addresses:
+            self._dns_host = address
+            try:
+                return super(_TimedConnection, self)._new_conn()
+            except (NewConnectionError, ConnectTimeoutError):
+                if address == addresses[-1]:
+                    raise
+            finally:
+                self._dns_host = dns_host
+
+    def request(self, *args, **kwargs):
+        timing = _timing()
+        if timing is not None:
+            timing['_sent'] = time.time()
+        return super(_TimedConnection, self).request(*args, **kwargs)
+
+    def getresponse(self, *args, **kwargs):
+        response = super(_TimedConnection, self).getresponse(*args, **kwargs)
+        timing = _timing()
+        if timing is not None and '_sent' in timing:
+            # from the request going out on an open connection to the headers
+            sent = max(timing['_sent'], timing.get('_ready', 0))
+            timing['ttfb'] = round(time.time() - sent, 4)
+        return response
+
+
+class TimedHTTPConnection(_TimedConnection, HTTPConnection):
+    pass
+
+
+class TimedHTTPSConnection(_TimedConnection, HTTPSConnection):
+
+    def connect(self):
+        super(TimedHTTPSConnection, self).connect()
+        timing = _timing()
+        if timing is not None and '_ready' in timing:
+            now = time.time()
+            timing['tls'] = round(now - timing['_ready'], 4)
+            timing['_ready'] = now
+
+
+class TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = TimedHTTPConnection
+
+
+class TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = TimedHTTPSConnection
+
+
+class TimedAdapter(HTTPAdapter):
+
+    def init_poolmanager(self, *args, **kwargs):
+        HTTPAdapter.init_poolmanager(self, *args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = dict(
+            http=TimedHTTPConnectionPool, https=TimedHTTPSConnectionPool)
+
+
+class BigSwitchClient(object):
+    '''
+    pooled, cookie authenticated REST client for a BCF or BMF controller.
+    subclasses pick their controller type with PROFILE
+    '''
+
+    PROFILE = 'bcf'
+
+    # fact clients map gather_subset sections to the FACT_URIS they need
+    # and build each section with a build_<section> method; bump
+    # FACTS_FORMAT when a section's layout changes so sections cached by
+    # an older module are rebuilt
+    FACT_URIS = {}
+    SUBSETS = {}
+    FACTS_FORMAT = '1'
+    # FACT_URIS returning long lists of which the builders only read a
+    # few fields; those are decoded while streaming and the rest dropped
+    FACT_FIELDS = {}
+
+    def __init__(self,
+                 username='admin',
+                 password='bsn123',
+                 controller_ip='192.168.200.102',
+                 port=None,
+                 protocol=None,
+                 pool_size=10,
+                 keepalive=True,
+                 connect_timeout=10,
+                 read_timeout=60,
+                 max_concurrency=1,
+                 cookie_cache=False,
+                 cookie_ttl=900,
+                 cache_dir='~/.ansible/bsn_cache',
+                 flush_cookie_cache=False,
+                 pool=None,
+                 profile=False,
+                 retries=2,
+                 retry_backoff=0.5,
+                 retry_max_delay=10,
+                 circuit_breaker=False,
+                 breaker_threshold=3,
+                 breaker_cooldown=60,
+                 rate_limit=None,
+                 rate_burst=None,
+                 max_in_flight=None,
+                 response_cache=False,
+                 connection=None,
+                 broker=False,
+                 broker_ttl=5):
+
+        settings = PROFILES[self.PROFILE]
+        self.username = username
+        self.password = password
+        self.controller_ip = controller_ip
+        self.port = port or settings['port']
+        self.protocol = protocol or settings['protocol']
+        self.login_uri = settings['login']
+        self.base_url = self.protocol + '://' + self.controller_ip + ':' + self.port
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_concurrency = max(max_concurrency, 1)
+        self.pool = pool
+        self.profile = profile
+        self.timings = []
+        self.retries = max(retries, 0)
+        self.retry_backoff = retry_backoff
+        self.retry_max_delay = retry_max_delay
+        # breaker state lives on disk so every fork talking to the same
+        # controller sees it
+        self.breaker = None
+        if circuit_breaker:
+            self.breaker = FileCache(cache_dir, 'breaker')
+        self.breaker_threshold = max(breaker_threshold, 1)
+        self.breaker_cooldown = breaker_cooldown
+        self._breaker_tripped = False
+        self._lock = threading.Lock()
+        # bumped on every login, so requests rejected with an older cookie
+        # know a fresh one is already there
+        self._login_lock = threading.Lock()
+        self._cookie_generation = 0
+        # unset limits come from the environment, so a whole play can be
+        # throttled without touching every task
+        if rate_limit is None:
+            rate_limit = float(os.environ.get('BSN_RATE_LIMIT', 0))
+        if rate_burst is None:
+            rate_burst = int(os.environ.get('BSN_RATE_BURST', 0)) or max(int(rate_limit), 1)
+        if max_in_flight is None:
+            max_in_flight = int(os.environ.get('BSN_MAX_IN_FLIGHT', 0))
+        self.rate_limiter = None
+        if rate_limit > 0:
+            self.rate_limiter = TokenBucket(cache_dir, self.base_url, rate_limit, rate_burst)
+        self.scheduler = None
+        if max_in_flight > 0:
+            self.scheduler = Scheduler.for_controller(self.base_url, max_in_flight)
+        self.session = self._build_session(max(pool_size, self.max_concurrency),
+                                           keepalive)
+        self.cookie_cache = None
+        if cookie_cache:
+            self.cookie_cache = FileCache(cache_dir, 'cookie')
+            if flush_cookie_cache:
+                self.invalidate_session_cookie()
+        self.cookie_ttl = cookie_ttl
+        self.response_cache = self.section_cache = None
+        if response_cache:
+            self.response_cache = FileCache(cache_dir, 'response')
+            self.section_cache = FileCache(cache_dir, 'section')
+        if connection is None and broker:
+            # the broker logs in with these settings the first time it
+            # sees this controller and user; None if it cannot be started
+            connection = BrokerConnection.connect(cache_dir, broker_ttl, dict(
+                profile=self.PROFILE, username=username, password=password,
+                controller_ip=controller_ip, port=self.port, protocol=self.protocol,
+                pool_size=pool_size, keepalive=keepalive,
+                connect_timeout=connect_timeout, read_timeout=read_timeout,
+                cookie_cache=cookie_cache, cookie_ttl=cookie_ttl,
+                cache_dir=cache_dir, retries=retries, retry_backoff=retry_backoff,
+                retry_max_delay=retry_max_delay, circuit_breaker=circuit_breaker,
+                breaker_threshold=breaker_threshold,
+                breaker_cooldown=breaker_cooldown, rate_limit=rate_limit,
+                rate_burst=rate_burst, max_in_flight=max_in_flight))
+        # with a persistent connection or the broker the calls go to a
+        # client kept in that process, which is already logged in
+        self.connection = connection
+        self.session_cookie = None
+        if connection is None:
+            self.session_cookie = self.get_session_cookie()
+
+    def _build_session(self, pool_size, keepalive):
+        # one pooled session per client so every REST call after the
+        # login reuses the same TCP/TLS connection to the controller
+        session = requests.Session()
+        session.verify = False
+        session.headers['Content-Type'] = 'application/json'
+        adapter = TimedAdapter(pool_connections=1, pool_maxsize=pool_size)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        if not keepalive:
+            session.headers['Connection'] = 'close'
+        return session
+
+    def get_session_cookie(self, refresh=False):
+        '''
+        log in, or reuse a cached cookie unless refresh is set. the
+        session sends the cookie with every following request
+        '''
+        cache_key = (self.base_url, self.username)
+        if self.cookie_cache and not refresh:
+            cookie, age = self.cookie_cache.get(cache_key)
+            if cookie and age < self.cookie_ttl:
+                self.session.cookies.set('session_cookie', cookie)
+                return cookie
+
+        self.session.cookies.clear()
+        data = {"password": self.password, "user": self.username}
+        # a login creates no state on the controller, retry it like a GET
+        rsp = self._send_retrying('POST', self.base_url + self.login_uri,
+                                  json.dumps(data), retry=True)
+        rsp.raise_for_status()
+
+        cookie = rsp.cookies.get('session_cookie')
+        if not cookie:
+            # older controllers only return it in the body
+            cookie = rsp.json().get('session_cookie')
+        self.session.cookies.set('session_cookie', cookie)
+        if self.cookie_cache and cookie:
+            self.cookie_cache.set(cache_key, cookie)
+        return cookie
+
+    def relogin(self, generation):
+        '''
+        log in again after a call made with the cookie of generation was
+        rejected. of concurrent callers that saw the same generation only
+        the first logs in; the others wait for it and reuse its cookie
+        '''
+        with self._login_lock:
+            if self._cookie_generation != generation:
+                return
+            self.invalidate_session_cookie()
+            self.session_cookie = self.get_session_cookie(refresh=True)
+            self._cookie_generation += 1
+
+    def invalidate_session_cookie(self):
+        if self.cookie_cache:
+            self.cookie_cache.delete((self.base_url, self.username))
+
+    def _send(self, verb, url, data=None, headers=None, stream=False):
+        timing = dict(uri=url[len(self.base_url):], verb=verb)
+        queued = time.time()
+        if self.scheduler:
+            self.scheduler.acquire(read=verb == 'GET')
+        try:
+            if self.rate_limiter:
+                self.rate_limiter.acquire()
+            _trace.timing = timing
+            _trace.profile = self.profile
+            start = time.time()
+            try:
+                # verify is repeated per request, otherwise a CA bundle set
+                # in the environment takes precedence over the session setting
+                rsp = self.session.request(verb, url, data=data, headers=headers,
+                                           timeout=self.timeout, stream=stream,
+                                           verify=self.session.verify)
+            finally:
+                _trace.timing = None
+        finally:
+            if self.scheduler:
+                self.scheduler.release()
+        elapsed = time.time() - start
+        timing.pop('_sent', None)
+        new_connection = timing.pop('_ready', None) is not None
+        if self.profile:
+            timing.update(start=round(start, 4), queued=round(start - queued, 4))
+            timing['bytes'] = 0 if stream else len(rsp.content)
+        else:
+            for key in ('dns', 'connect', 'tls', 'ttfb'):
+                timing.pop(key, None)
+        timing.update(status=rsp.status_code, elapsed=round(elapsed, 4),
+                      new_connection=new_connection)
+        with self._lock:
+            self.timings.append(timing)
+        # api_call adds the json decode time to it, and for a streamed
+        # response the time and bytes of reading the body
+        rsp.timing = timing
+        return rsp
+
+    def _send_retrying(self, verb, url, data=None, retry=None, headers=None,
+                       stream=False):
+        '''
+        _send, repeated on connection errors, timeouts and 502/503/504
+        with exponentially growing, fully jittered pauses. only
+        idempotent verbs are repeated unless retry says otherwise. the
+        outcome feeds the circuit breaker, and an open breaker refuses
+        the call right away
+        '''
+        if retry is None:
+            retry = verb in IDEMPOTENT_VERBS
+        self._check_breaker()
+        attempt = 0
+        while True:
+            error = rsp = None
+            try:
+                rsp = self._send(verb, url, data, headers, stream)
+            except (requests.exceptions.ConnectionError,
+                    requests.exceptions.Timeout) as exc:
+                error = exc
+            if rsp is not None and rsp.status_code not in RETRY_STATUS:
+                self._breaker_success()
+                return rsp
+            if not retry or attempt >= self.retries:
+                self._breaker_failure()
+                if error is not None:
+                    raise error
+                return rsp
+            if rsp is not None:
+                rsp.close()
+            delay = min(self.retry_max_delay, self.retry_backoff * 2 ** attempt)
+            time.sleep(random.uniform(0, delay))
+            attempt += 1
+
+    def _check_breaker(self):
+        if self.breaker is None:
+            return
+        state, age = self.breaker.get((self.base_url,))
+        if state is None:
+            return
+        self._breaker_tripped = True
+        # after the cooldown calls go through again; the first failure
+        # reopens the breaker, the first success closes it
+        if state['failures'] >= self.breaker_threshold and age < self.breaker_cooldown:
+            raise BigSwitchError('circuit breaker open for %s after %d failures, '
+                                 'retrying in %ds' % (self.controller_ip, state['failures'],
+                                                      self.breaker_cooldown - age))
+
+    def _breaker_failure(self):
+        if self.breaker is None:
+            return
+        with self._lock:
+            state, age = self.breaker.get((self.base_url,))
+            failures = state['failures'] if state else 0
+            self.breaker.set((self.base_url,), dict(failures=failures + 1))
+            self._breaker_tripped = True
+
+    def _breaker_success(self):
+        if self.breaker is None or not self._breaker_tripped:
+            return
+        with self._lock:
+            self.breaker.delete((self.base_url,))
+            self._breaker_tripped = False
+
+    def connection_stats(self):
+        '''
+        per-call timings plus an estimate of the handshake time saved,
+        i.e. the extra cost of a fresh connection times the reused calls
+        '''
+        opened = [t['elapsed'] for t in self.timings if t['new_connection']]
+        reused = [t['elapsed'] for t in self.timings if not t['new_connection']]
+        saved = 0
+        if opened and reused:
+            handshake = sum(opened) / len(opened) - sum(reused) / len(reused)
+            saved = max(handshake, 0) * len(reused)
+        return dict(
+            requests=len(self.timings),
+            connections_opened=len(opened),
+            connections_reused=len(reused),
+            handshake_saved=round(saved, 4),
+            calls=self.timings
+            )
+
+    def timing_report(self):
+        '''
+        the calls recorded while profiling plus, per endpoint, how often
+        it was called, its total and slowest time and the bytes received,
+        slowest endpoint first
+        '''
+        endpoints = {}
+        for call in self.timings:
+            name = call['verb'] + ' ' + call['uri']
+            entry = endpoints.setdefault(name, dict(endpoint=name, calls=0, total=0,
+                                                    slowest=0, bytes=0))
+            entry['calls'] += 1
+            entry['total'] = round(entry['total'] + call['elapsed'], 4)
+            entry['slowest'] = max(entry['slowest'], call['elapsed'])
+            entry['bytes'] += call.get('bytes', 0)
+        return dict(
+            calls=self.timings,
+            endpoints=sorted(endpoints.values(), key=lambda e: -e['total'])
+            )
+
+    def write_trace(self, path):
+        '''
+        append the recorded calls to path, one json object per line
+        tagged with the controller, for offline analysis
+        '''
+        lines = [json.dumps(dict(call, controller=self.controller_ip)) + '\n'
+                 for call in self.timings]
+        with open(os.path.expanduser(path), 'a') as trace_file:
+            trace_file.write(''.join(lines))
+
+    def request(self, uri, verb='GET', data=None, headers=None, stream=False):
+        '''
+        send one REST call, with retries, and return the response. a 401
+        or 403 means the cookie expired on the controller: log in again,
+        once for all the calls in flight, and replay the call
+        '''
+        if self.connection is not None:
+            return self._request_persistent(uri, verb, data, headers)
+        # request state stays local so request is safe to run in threads
+        url = self.base_url + uri
+        body = None
+        if verb != 'GET' and data is not None:
+            body = json.dumps(data)
+        generation = self._cookie_generation
+        if not self.session_cookie:
+            self.relogin(generation)
+            generation = self._cookie_generation
+        rsp = self._send_retrying(verb, url, body, headers=headers, stream=stream)
+        if rsp.status_code in AUTH_STATUS:
+            rsp.close()
+            self.relogin(generation)
+            rsp = self._send_retrying(verb, url, body, headers=headers, stream=stream)
+        return rsp
+
+    def _request_persistent(self, uri, verb, data, headers):
+        '''
+        request through the bsn httpapi plugin or the request broker; the
+        reply is turned back into a requests response so the callers need
+        not tell them apart
+        '''
+        start = time.time()
+        reply = self.connection.send_request(data, path=uri, method=verb,
+                                             headers=headers)
+        rsp = requests.models.Response()
+        rsp.status_code = reply['status']
+        rsp.reason = reply['reason']
+        rsp.url = self.base_url + uri
+        rsp.headers = CaseInsensitiveDict(reply['headers'])
+        rsp.encoding = 'utf-8'
+        rsp._content = reply['body'].encode('utf-8')
+        rsp._content_consumed = True
+        timing = dict(uri=uri, verb=verb, status=rsp.status_code,
+                      elapsed=round(time.time() - start, 4), new_connection=False)
+        if 'broker' in reply:
+            # sent, shared with an identical call in flight, or cached
+            timing['broker'] = reply['broker']
+        if self.profile:
+            timing.update(start=round(start, 4), bytes=len(rsp._content))
+        with self._lock:
+            self.timings.append(timing)
+        rsp.timing = timing
+        return rsp
+
+    def api_call(self, uri, verb='GET', data=None, fields=None):
+        '''
+        decoded json output of a REST call, None for an empty body.
+        raises requests.HTTPError when the controller returns an error.
+        with fields, a list output is decoded one item at a time while it
+        is read and only those fields of each item are kept; a dotted
+        field such as attributes.description-data keeps a nested one
+        '''
+        rsp = self.request(uri, verb, data, stream=bool(fields))
+        rsp.raise_for_status()
+        if fields:
+            return self._decode_streaming(rsp, fields)
+        return self._decode(rsp)
+
+    def _decode(self, rsp):
+        if not rsp.text:
+            return None
+        start = time.time()
+        output = json.loads(rsp.text)
+        if self.profile:
+            rsp.timing['decode'] = round(time.time() - start, 4)
+        return output
+
+    def _decode_streaming(self, rsp, fields, digest=None):
+        '''
+        read and decode a streamed response with load_projected, feeding
+        the raw body to digest if given
+        '''
+        start = time.time()
+        received = [0]
+        text = codecs.getincrementaldecoder('utf-8')()
+
+        def chunks():
+            for chunk in rsp.iter_content(STREAM_CHUNK):
+                received[0] += len(chunk)
+                if digest is not None:
+                    digest.update(chunk)
+                yield text.decode(chunk)
+            yield text.decode(b'', True)
+
+        body = chunks()
+        try:
+            output = load_projected(body, fields)
+            # read what follows the list so the connection goes back to
+            # the pool
+            for _ in body:
+                pass
+        finally:
+            rsp.close()
+        # reading and decoding overlap, both count as decode time
+        spent = time.time() - start
+        rsp.timing['elapsed'] = round(rsp.timing['elapsed'] + spent, 4)
+        if self.profile:
+            rsp.timing.update(bytes=received[0], decode=round(spent, 4))
+        return output
+
+    def api_call_conditional(self, uri, fields=None):
+        '''
+        GET uri through the response cache and return (version, output).
+        the controller is asked for changes only when it sent an ETag or
+        Last-Modified before; otherwise the body is compared by hash.
+        output is None, and the body is not decoded, when the response is
+        the same as last time. version identifies the content. a response
+        streamed for fields is hashed while it is decoded, so only its
+        output is dropped when it did not change
+        '''
+        cache_key = (self.base_url, uri)
+        known = self.response_cache.get(cache_key)[0] or {}
+        headers = {}
+        if known.get('etag'):
+            headers['If-None-Match'] = known['etag']
+        if known.get('last_modified'):
+            headers['If-Modified-Since'] = known['last_modified']
+        rsp = self.request(uri, 'GET', headers=headers, stream=bool(fields))
+        if rsp.status_code == 304 and known:
+            rsp.close()
+            return known['version'], None
+        rsp.raise_for_status()
+        output = None
+        if fields:
+            digest = hashlib.sha1()
+            output = self._decode_streaming(rsp, fields, digest)
+            version = digest.hexdigest()
+        else:
+            version = hashlib.sha1(rsp.content).hexdigest()
+        entry = dict(version=version,
+                     etag=rsp.headers.get('ETag'),
+                     last_modified=rsp.headers.get('Last-Modified'))
+        if entry != known:
+            self.response_cache.set(cache_key, entry)
+        if version == known.get('version'):
+            return version, None
+        if not fields:
+            output = self._decode(rsp)
+        return version, output
+
+    def api_calls(self, calls, fields=None):
+        '''
+        issue independent GETs, at most max_concurrency at a time, and
+        return the decoded output of each keyed like the calls dict. they
+        go to the shared request pool if the client was given one.
+        fields maps call names to the fields api_call should keep
+        '''
+        return self._fan_out(self.api_call, calls, fields or {})
+
+    def api_calls_conditional(self, calls, fields=None):
+        '''
+        api_calls through api_call_conditional: {name: (version, output)}
+        '''
+        return self._fan_out(self.api_call_conditional, calls, fields or {})
+
+    def _fan_out(self, call, calls, fields):
+        if self.pool is None and min(self.max_concurrency, len(calls)) <= 1:
+            return dict((name, call(uri, fields=fields.get(name)))
+                        for name, uri in sorted(calls.items()))
+
+        pool = self.pool or RequestPool(min(self.max_concurrency, len(calls)))
+        try:
+            futures = [(name, pool.submit(call, uri, fields=fields.get(name)))
+                       for name, uri in sorted(calls.items())]
+            return dict((name, future.result()) for name, future in futures)
+        finally:
+            if pool is not self.pool:
+                pool.close()
+
+    def gather_sections(self, subset):
+        '''
+        {section: facts} for each gather_subset section, built by the
+        build_<section> method from the outputs of the FACT_URIS the
+        section needs. with the response cache, a section whose
+        responses are all unchanged is reused from the previous run
+        without decoding or building anything
+        '''
+        calls = {}
+        for section in subset:
+            for name in self.SUBSETS[section]:
+                calls[name] = self.FACT_URIS[name]
+        if self.response_cache is None:
+            rsp = self.api_calls(calls, self.FACT_FIELDS)
+            return dict((section, getattr(self, 'build_' + section)(rsp))
+                        for section in subset)
+
+        versions = self.api_calls_conditional(calls, self.FACT_FIELDS)
+        rsp = dict((name, output) for name, (_, output) in versions.items()
+                   if output is not None)
+        sections, stale = {}, {}
+        for section in subset:
+            cache_key = (self.base_url, self.PROFILE, self.FACTS_FORMAT, section)
+            wanted = [versions[name][0] for name in sorted(self.SUBSETS[section])]
+            cached = self.section_cache.get(cache_key)[0]
+            if cached and cached['versions'] == wanted:
+                sections[section] = cached['facts']
+            else:
+                stale[section] = (cache_key, wanted)
+
+        # a stale section can still need a response that did not change,
+        # e.g. after a different gather_subset; fetch those in full
+        missing = dict((name, self.FACT_URIS[name]) for section in stale
+                       for name in self.SUBSETS[section] if name not in rsp)
+        rsp.update(self.api_calls(missing, self.FACT_FIELDS))
+        for section, (cache_key, wanted) in stale.items():
+            sections[section] = getattr(self, 'build_' + section)(rsp)
+            self.section_cache.set(cache_key, dict(versions=wanted,
+                                                   facts=sections[section]))
+        return sections
+
+    def api_call_async(self, uri, verb='GET', data=None, pool=None):
+        '''
+        submit api_call to the request pool and return its Future. without
+        a pool the call is made right away and returned as a done Future
+        '''
+        pool = pool or self.pool
+        if pool is not None:
+            return pool.submit(self.api_call, uri, verb, data)
+        future = Future()
+        try:
+            future.set_result(self.api_call(uri, verb, data))
+        except Exception as exc:
+            future.set_error(exc)
+        return future
+
+
+class TokenBucket(object):
+    '''
+    token bucket of rate calls per second, up to burst at once, kept in
+    a file under cache_dir and locked with flock, so every process on
+    this host calling the controller draws from the same bucket
+    '''
+
+    def __init__(self, cache_dir, key, rate, burst):
+        self.cache_dir = os.path.expanduser(cache_dir)
+        digest = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        self.path = os.path.join(self.cache_dir, 'ratelimit-' + digest + '.json')
+        self.rate = float(rate)
+        self.burst = max(burst, 1)
+
+    def acquire(self):
+        '''
+        take a token, sleeping until one is available
+        '''
+        while True:
+            wait = self._take()
+            if not wait:
+                return
+            time.sleep(wait)
+
+    def _take(self):
+        '''
+        take a token and return 0, or return the seconds until the next
+        token if the bucket is empty
+        '''
+        if not os.path.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir, 0o700)
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            now = time.time()
+            try:
+                tokens, stamp = json.loads(os.read(fd, 256).decode('utf-8'))
+            except ValueError:
+                tokens, stamp = self.burst, now
+            tokens = min(self.burst, tokens + (now - stamp) * self.rate)
+            wait = 0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                wait = (1 - tokens) / self.rate
+            os.lseek(fd, 0, os.SEEK_SET)
+            os.ftruncate(fd, 0)
+            os.write(fd, json.dumps([tokens, now]).encode('utf-8'))
+            return wait
+        finally:
+            # closing the descriptor drops the lock
+            os.close(fd)
+
+
+class Scheduler(object):
+    '''
+    caps the calls this process has in flight to one controller. calls
+    waiting for a slot go GETs first, so reads are not queued behind a
+    batch of writes
+    '''
+
+    _registry = {}
+    _registry_lock = threading.Lock()
+
+    def __init__(self, max_in_flight):
+        self.max_in_flight = max_in_flight
+        self.in_flight = 0
+        self.waiting_reads = 0
+        self._cond = threading.Condition()
+
+    @classmethod
+    def for_controller(cls, key, max_in_flight):
+        '''
+        the scheduler every client of the controller in this process shares
+        '''
+        with cls._registry_lock:
+            if key not in cls._registry:
+                cls._registry[key] = cls(max_in_flight)
+            return cls._registry[key]
+
+    def acquire(self, read):
+        with self._cond:
+            if read:
+                self.waiting_reads += 1
+            try:
+                while (self.in_flight >= self.max_in_flight or
+                       (not read and self.waiting_reads)):
+                    self._cond.wait()
+            finally:
+                if read:
+                    self.waiting_reads -= 1
+            self.in_flight += 1
+
+    def release(self):
+        with self._cond:
+            self.in_flight -= 1
+            self._cond.notify_all()
+
+
+class Future(object):
+    '''
+    result of a call submitted to a RequestPool
+    '''
+
+    def __init__(self):
+        self._done = threading.Event()
+        self._value = None
+        self._error = None
+
+    def set_result(self, value):
+        self._value = value
+        self._done.set()
+
+    def set_error(self, error):
+        self._error = error
+        self._done.set()
+
+    def done(self):
+        return self._done.is_set()
+
+    def result(self, timeout=None):
+        if not self._done.wait(timeout):
+            raise RuntimeError('call did not finish in %s seconds' % timeout)
+        if self._error is not None:
+            raise self._error
+        return self._value
+
+
+class RequestPool(object):
+    '''
+    fixed set of worker threads that any number of clients, controllers
+    included, submit their REST calls to. the requests in flight across
+    all of them are bounded by size, not by how many endpoints or
+    controllers are being gathered. calls run here must not wait on other
+    calls of the same pool
+    '''
+
+    def __init__(self, size=8):
+        self.size = max(size, 1)
+        self._queue = queue.Queue()
+        self._threads = []
+        for _ in range(self.size):
+            thread = threading.Thread(target=self._worker)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def _worker(self):
+        while True:
+            task = self._queue.get()
+            if task is None:
+                return
+            future, func, args, kwargs = task
+            try:
+                future.set_result(func(*args, **kwargs))
+            except Exception as exc:
+                future.set_error(exc)
+
+    def submit(self, func, *args, **kwargs):
+        future = Future()
+        self._queue.put((future, func, args, kwargs))
+        return future
+
+    def close(self):
+        '''
+        let the queued calls finish and stop the workers
+        '''
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+
+
+class FileCache(object):
+    '''
+    small json store kept between module runs; the directory is created
+    0700 and every entry is written 0600 since entries hold credentials
+    '''
+
+    def __init__(self, cache_dir, namespace):
+        self.cache_dir = os.path.expanduser(cache_dir)
+        self.namespace = namespace
+
+    def _path(self, key):
+        digest = hashlib.sha1('|'.join(key).encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, self.namespace + '-' + digest + '.json')
+
+    def get(self, key):
+        '''
+        returns (value, age in seconds), or (None, None) when the key has
+        no readable entry
+        '''
+        try:
+            with open(self._path(key)) as cache_file:
+                entry = json.load(cache_file)
+        except (IOError, OSError, ValueError):
+            return None, None
+        return entry['value'], time.time() - entry['created']
+
+    def set(self, key, value):
+        if not os.path.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir, 0o700)
+        # mkstemp creates the file 0600, rename makes the write atomic
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir)
+        with os.fdopen(fd, 'w') as cache_file:
+            json.dump(dict(created=time.time(), value=value), cache_file)
+        os.rename(tmp_path, self._path(key))
+
+    def delete(self, key):
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+    def claim(self, key, timeout):
+        '''
+        take an exclusive marker for key so only one process refreshes
+        it; a marker older than timeout is treated as abandoned
+        '''
+        if not os.path.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir, 0o700)
+        marker = self._path(key) + '.lock'
+        try:
+            if time.time() - os.path.getmtime(marker) > timeout:
+                os.remove(marker)
+        except OSError:
+            pass
+        try:
+            os.close(os.open(marker, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o600))
+        except OSError:
+            return False
+        return True
+
+    def release(self, key):
+        try:
+            os.remove(self._path(key) + '.lock')
+        except OSError:
+            pass
+
+
+def run_detached(func):
+    '''
+    run func in a grandchild process cut off from the module's stdio, so
+    ansible reads the module result without waiting for func to finish
+    '''
+    pid = os.fork()
+    if pid:
+        os.waitpid(pid, 0)
+        return
+    try:
+        os.setsid()
+        if os.fork():
+            os._exit(0)
+        devnull = os.open(os.devnull, os.O_RDWR)
+        for fd in (0, 1, 2):
+            os.dup2(devnull, fd)
+        func()
+    finally:
+        os._exit(0)
+
+
+class Broker(object):
+    '''
+    local request broker every module run on this host can send its REST
+    calls to over a unix socket in cache_dir. identical GETs in flight
+    at once go to the controller as one request whose response every
+    caller gets, and GET responses are reused for the ttl the caller
+    asks for. any other verb is sent as is and drops the cached
+    responses of its controller. one logged in client is kept per
+    controller and user; the broker exits after BROKER_IDLE seconds
+    without a request
+    '''
+
+    def __init__(self, path, idle_timeout=BROKER_IDLE):
+        self.path = path
+        self.idle_timeout = idle_timeout
+        self.last_request = time.time()
+        self._clients = {}
+        self._flights = {}
+        self._responses = {}
+        self._lock = threading.Lock()
+
+    def client(self, settings):
+        settings = dict(settings)
+        kind = settings.pop('profile')
+        key = (kind, settings['protocol'], settings['controller_ip'], settings['port'],
+               settings['username'],
+               hashlib.sha1((settings['password'] or '').encode('utf-8')).hexdigest())
+        with self._lock:
+            entry = self._clients.setdefault(key, [threading.Lock(), None])
+        # a slow login holds up the calls to its controller only
+        with entry[0]:
+            if entry[1] is None:
+                client = type('BigSwitchClient', (BigSwitchClient,), dict(PROFILE=kind))
+                entry[1] = client(**settings)
+        return key, entry[1]
+
+    def handle(self, message):
+        '''
+        one request from a module: the reply has the status, reason,
+        headers and body of the response, or an error
+        '''
+        self.last_request = time.time()
+        key, client = self.client(message['settings'])
+        verb, uri = message['verb'], message['uri']
+
+        def send():
+            rsp = client.request(uri, verb, message['data'], message['headers'])
+            # nothing reports the broker's timings, do not let them pile up
+            with client._lock:
+                del client.timings[:]
+            return dict(status=rsp.status_code, reason=rsp.reason,
+                        headers=dict(rsp.headers), body=rsp.text)
+
+        if verb != 'GET':
+            with self._lock:
+                for cached in [k for k in self._responses if k[0] == key]:
+                    del self._responses[cached]
+            return dict(send(), broker='sent')
+
+        request_key = (key, uri, json.dumps(message['headers'], sort_keys=True))
+        with self._lock:
+            cached = self._responses.get(request_key)
+            if cached is not None and time.time() - cached[0] < message['ttl']:
+                return dict(cached[1], broker='cached')
+            flight = self._flights.get(request_key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[request_key] = Future()
+        if not leader:
+            return dict(flight.result(), broker='shared')
+        try:
+            reply = send()
+        except Exception as exc:
+            with self._lock:
+                del self._flights[request_key]
+            flight.set_error(exc)
+            raise
+        with self._lock:
+            # cache before the flight ends so no caller misses both
+            if reply['status'] < 300:
+                self._responses[request_key] = (time.time(), reply)
+            del self._flights[request_key]
+        flight.set_result(reply)
+        return dict(reply, broker='sent')
+
+    def serve(self):
+        broker = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                try:
+                    reply = broker.handle(json.loads(self.rfile.readline().decode('utf-8')))
+                except Exception as exc:
+                    reply = dict(error='%s: %s' % (type(exc).__name__, exc))
+                self.wfile.write(json.dumps(reply).encode('utf-8'))
+
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        os.umask(0o077)
+        server = socketserver.ThreadingUnixStreamServer(self.path, Handler)
+        server.daemon_threads = True
+
+        def watch_idle():
+            while time.time() - self.last_request < self.idle_timeout:
+                time.sleep(1)
+            server.shutdown()
+
+        watcher = threading.Thread(target=watch_idle)
+        watcher.daemon = True
+        watcher.start()
+        try:
+            server.serve_forever(poll_interval=0.5)
+        finally:
+            server.server_close()
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+
+
+class BrokerConnection(object):
+    '''
+    connection to the Broker of cache_dir, with the send_request of the
+    bsn httpapi plugin. settings are the client arguments the broker
+    logs in with, sent over the socket, which is only open to this user
+    '''
+
+    def __init__(self, path, ttl, settings):
+        self.path = path
+        self.ttl = ttl
+        self.settings = settings
+
+    @classmethod
+    def connect(cls, cache_dir, ttl, settings):
+        '''
+        a connection to the running broker, started first if there is
+        none; of the module runs starting at once only one starts it.
+        None when it does not come up
+        '''
+        cache_dir = os.path.expanduser(cache_dir)
+        path = os.path.join(cache_dir, 'broker.sock')
+        if cls._listening(path):
+            return cls(path, ttl, settings)
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir, 0o700)
+        fd = os.open(os.path.join(cache_dir, 'broker.lock'), os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            if not cls._listening(path):
+                def serve():
+                    # the broker must not hold the lock
+                    os.close(fd)
+                    os.chdir(cache_dir)
+                    Broker(path).serve()
+                run_detached(serve)
+                deadline = time.time() + 5
+                while not cls._listening(path) and time.time() < deadline:
+                    time.sleep(0.05)
+        finally:
+            os.close(fd)
+        if cls._listening(path):
+            return cls(path, ttl, settings)
+        return None
+
+    @staticmethod
+    def _listening(path):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(path)
+            return True
+        except socket.error:
+            return False
+        finally:
+            sock.close()
+
+    def send_request(self, data, path, method='GET', headers=None):
+        message = dict(settings=self.settings, ttl=self.ttl, uri=path, verb=method,
+                       data=data, headers=headers or {})
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(self.path)
+            sock.sendall(json.dumps(message).encode('utf-8') + b'\n')
+            chunks = []
+            while True:
+                chunk = sock.recv(STREAM_CHUNK)
+                if not chunk:
+                    break
+                chunks.append(chunk)
+        except socket.error as exc:
+            if exc.errno in (errno.ECONNREFUSED, errno.ENOENT):
+                raise BigSwitchError('request broker at %s is not running' % self.path)
+            raise BigSwitchError('request broker at %s: %s' % (self.path, exc))
+        finally:
+            sock.close()
+        reply = json.loads(b''.join(chunks).decode('utf-8'))
+        if 'error' in reply:
+            raise BigSwitchError(reply['error'])
+        return reply
+
+
+def projector(fields):
+    '''
+    function returning a copy of the fields of a dict item; a dotted
+    field copies a nested value and keeps its parents, e.g.
+    attributes.description-data
+    '''
+    flat = [field for field in fields if '.' not in field]
+    nested = [field.split('.') for field in fields if '.' in field]
+
+    def project(item):
+        if not isinstance(item, dict):
+            return item
+        projected = {}
+        for key in flat:
+            if key in item:
+                projected[key] = item[key]
+        for path in nested:
+            source, target = item, projected
+            for key in path[:-1]:
+                source = source.get(key)
+                if not isinstance(source, dict):
+                    break
+                target = target.setdefault(key, {})
+            else:
+                if path[-1] in source:
+                    target[path[-1]] = source[path[-1]]
+        return projected
+    return project
+
+
+def load_projected(chunks, fields):
+    '''
+    decode json text arriving as chunks. a list is decoded one item at
+    a time and only the projection of each item is kept, so memory
+    holds the projected items plus one chunk rather than the whole body
+    and its object tree. anything else is decoded in full. None for an
+    empty body
+    '''
+    decoder = json.JSONDecoder()
+    project = projector(fields)
+    chunks = iter(chunks)
+    buf, pos = '', 0
+    items = None
+    while True:
+        while pos < len(buf) and buf[pos] in ' \t\r\n':
+            pos += 1
+        if pos < len(buf):
+            char = buf[pos]
+            if items is None:
+                if char != '[':
+                    return json.loads(buf[pos:] + ''.join(chunks))
+                items = []
+                pos += 1
+                continue
+            if char == ']':
+                return items
+            if char == ',':
+                pos += 1
+                continue
+            try:
+                item, end = decoder.raw_decode(buf, pos)
+            except ValueError:
+                end = None
+            # a number cut in two at a chunk boundary, e.g. 12|.5 or 1e|3,
+            # decodes as a shorter one; take an item only once the , or ]
+            # after it has arrived
+            after = end
+            while after is not None and after < len(buf) and buf[after] in ' \t\r\n':
+                after += 1
+            if after is not None and after < len(buf) and buf[after] in ',]':
+                items.append(project(item))
+                pos = end
+                continue
+        chunk = next(chunks, None)
+        if chunk is None:
+            break
+        buf, pos = buf[pos:] + chunk, 0
+    if items is not None:
+        raise ValueError('truncated json list')
+    return None
+
+
+def parse_gather_subset(gather_subset, subsets):
+    '''
+    turn a gather_subset list such as ['all', '!nodes'] into the set of
+    fact sections to collect; a list of only exclusions starts from all
+    '''
+    gather_subset = gather_subset or ['all']
+    selected = set()
+    if all(entry.startswith('!') for entry in gather_subset):
+        selected.update(subsets)
+    for entry in gather_subset:
+        exclude = entry.startswith('!')
+        name = entry.lstrip('!')
+        if name == 'all':
+            names = set(subsets)
+        elif name in subsets:
+            names = set([name])
+        else:
+            raise ValueError('unknown gather_subset entry: %s (choose from %s)'
+                             % (entry, ', '.join(['all'] + sorted(subsets))))
+        if exclude:
+            selected.difference_update(names)
+        else:
+            selected.update(names)
+    return selected
+
+
+# module options named differently from the BigSwitchClient argument
+CLIENT_PARAMS = dict(
+    cookie_cache_ttl='cookie_ttl',
+    circuit_breaker_threshold='breaker_threshold',
+    circuit_breaker_cooldown='breaker_cooldown',
+)
+
+
+def client_argument_spec(**overrides):
+    '''
+    argument_spec entries for the BigSwitchClient options every module
+    takes; keyword arguments replace entries, e.g. username=dict(required=True)
+    '''
+    spec = dict(
+        username=dict(),
+        password=dict(no_log=True),
+        pool_size=dict(type='int', default=10),
+        keepalive=dict(type='bool', default=True),
+        connect_timeout=dict(type='int', default=10),
+        read_timeout=dict(type='int', default=60),
+        max_concurrency=dict(type='int', default=1),
+        cookie_cache=dict(type='bool', default=False),
+        cookie_cache_ttl=dict(type='int', default=900),
+        cache_dir=dict(default='~/.ansible/bsn_cache'),
+        flush_cookie_cache=dict(type='bool', default=False),
+        response_cache=dict(type='bool', default=False),
+        retries=dict(type='int', default=2),
+        retry_backoff=dict(type='float', default=0.5),
+        circuit_breaker=dict(type='bool', default=False),
+        circuit_breaker_threshold=dict(type='int', default=3),
+        circuit_breaker_cooldown=dict(type='int', default=60),
+        rate_limit=dict(type='float'),
+        rate_burst=dict(type='int'),
+        max_in_flight=dict(type='int'),
+        broker=dict(type='bool', default=False),
+        broker_ttl=dict(type='float', default=5),
+    )
+    spec.update(overrides)
+    return spec
+
+
+def client_kwargs(params, **kwargs):
+    '''
+    BigSwitchClient keyword arguments from the params of a module built
+    with client_argument_spec(); options the module left out of its spec
+    keep the client's default, kwargs add or replace arguments
+    '''
+    options = dict((CLIENT_PARAMS.get(name, name), params[name])
+                   for name in client_argument_spec() if name in params)
+    options.update(kwargs)
+    return options
+
+
+def gather_controllers(controllers, gather, max_concurrency):
+    '''
+    call gather(controller) for each controller, at most max_concurrency
+    at a time. one controller failing does not stop the others; returns
+    {controller: {'facts', 'error', 'elapsed'}}
+    '''
+    pending = iter(controllers)
+    lock = threading.Lock()
+    results = {}
+
+    def worker():
+        while True:
+            with lock:
+                controller = next(pending, None)
+            if controller is None:
+                return
+            start = time.time()
+            try:
+                facts, error = gather(controller), None
+            except Exception as exc:
+                facts, error = None, str(exc)
+            results[controller] = dict(facts=facts, error=error,
+                                       elapsed=round(time.time() - start, 4))
+
+    threads = [threading.Thread(target=worker)
+               for _ in range(max(1, min(max_concurrency, len(controllers))))]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def diff_facts(previous, current):
+    '''
+    structured difference between two facts dicts: fabric nodes added,
+    removed or changed (matched by dpid), controller role changes (by
+    hostname), summary counters that moved and any other fact that
+    changed, each as {'old', 'new'}. empty when nothing drifted.
+    controller uptimes are left out, they change on every run
+    '''
+    def changes(old, new):
+        return dict((key, dict(old=old.get(key), new=new.get(key)))
+                    for key in set(old) | set(new) if old.get(key) != new.get(key))
+
+    def by_dpid(facts):
+        return dict((node.get('dpid'), node) for node in facts.get('fabric_nodes') or [])
+
+    delta = {}
+    old_nodes, new_nodes = by_dpid(previous), by_dpid(current)
+    nodes = dict(
+        added=[new_nodes[dpid] for dpid in sorted(new_nodes) if dpid not in old_nodes],
+        removed=[old_nodes[dpid] for dpid in sorted(old_nodes) if dpid not in new_nodes],
+        changed=[dict(dpid=dpid, changes=changes(old_nodes[dpid], new_nodes[dpid]))
+                 for dpid in sorted(new_nodes)
+                 if dpid in old_nodes and old_nodes[dpid] != new_nodes[dpid]],
+    )
+    if any(nodes.values()):
+        delta['fabric_nodes'] = nodes
+
+    handled = ['fabric_nodes', 'summary']
+    old_cluster, new_cluster = previous.get('cluster'), current.get('cluster')
+    if isinstance(old_cluster, dict) or isinstance(new_cluster, dict):
+        handled.append('cluster')
+        # a cluster the controller could not report, such as bmf's 'N/A'
+        old_cluster = old_cluster if isinstance(old_cluster, dict) else {}
+        new_cluster = new_cluster if isinstance(new_cluster, dict) else {}
+        roles = changes(
+            dict((each.get('hostname'), each.get('role'))
+                 for each in old_cluster.get('controllers') or []),
+            dict((each.get('hostname'), each.get('role'))
+                 for each in new_cluster.get('controllers') or []))
+        if roles:
+            delta['controller_roles'] = roles
+        cluster = changes(
+            dict(item for item in old_cluster.items() if item[0] != 'controllers'),
+            dict(item for item in new_cluster.items() if item[0] != 'controllers'))
+        if cluster:
+            delta['cluster'] = cluster
+
+    summary = changes(previous.get('summary') or {}, current.get('summary') or {})
+    if summary:
+        delta['summary'] = summary
+
+    other = changes(dict(item for item in previous.items() if item[0] not in handled),
+                    dict(item for item in current.items() if item[0] not in handled))
+    if other:
+        delta['facts'] = other
+    return delta
+
+
+def facts_argument_spec():
+    '''
+    argument_spec of the fact modules, whose main() is run_facts_module
+    '''
+    spec = dict(
+        controller=dict(),
+        controllers=dict(type='list'),
+        controller_concurrency=dict(type='int', default=8),
+        gather_subset=dict(type='list', default=['all']),
+        facts_cache=dict(type='bool', default=False),
+        facts_cache_ttl=dict(type='int', default=300),
+        stale_while_revalidate=dict(type='int', default=0),
+        facts_delta=dict(type='bool', default=False),
+        profile=dict(type='bool', default=False),
+        trace_file=dict(),
+    )
+    spec.update(client_argument_spec())
+    return spec
+
+
+def run_facts_module(module, client_class, name):
+    '''
+    gather the facts of the controller, or of each of controllers, with
+    client_class and exit the module with them as ansible_facts[name]
+    (with facts_delta, what changed since the previous run as name_delta).
+    a task run with connection httpapi uses the session of the connection
+    '''
+    params = module.params
+    controller = params['controller']
+
+    connection = port = protocol = None
+    if getattr(module, '_socket_path', None) and params['controllers'] is None:
+        connection = Connection(module._socket_path)
+        try:
+            settings = connection.bsn_controller()
+        except ConnectionError as exc:
+            module.fail_json(msg='httpapi connection: %s' % exc)
+        if settings['type'] != client_class.PROFILE:
+            module.fail_json(msg='the httpapi connection is to a %s controller, '
+                                 'set ansible_bsn_controller_type' % settings['type'])
+        controller = settings['controller_ip']
+        port, protocol = settings['port'], settings['protocol']
+    elif not (controller or params['controllers']):
+        module.fail_json(msg='one of controller or controllers is required')
+    elif not (params['username'] and params['password']):
+        module.fail_json(msg='username and password are required')
+
+    try:
+        subset = sorted(parse_gather_subset(params['gather_subset'],
+                                            client_class.SUBSETS))
+    except ValueError as exc:
+        module.fail_json(msg=str(exc))
+
+    trace_file = params['trace_file']
+    profile = params['profile'] or bool(trace_file)
+    reports = {}
+    pool = None
+
+    def cache_key(controller):
+        # snapshots and cached facts of an older layout are not used
+        return (controller, client_class.PROFILE, client_class.FACTS_FORMAT,
+                ','.join(subset))
+
+    def gather(controller=controller):
+        fabric = client_class(**client_kwargs(params,
+                                              controller_ip=controller,
+                                              pool=pool,
+                                              profile=profile,
+                                              connection=connection,
+                                              port=port,
+                                              protocol=protocol))
+        try:
+            return fabric, fabric.facts(subset)
+        finally:
+            if profile:
+                reports[controller] = fabric.timing_report()
+            if trace_file:
+                fabric.write_trace(trace_file)
+
+    def gather_or_fail():
+        try:
+            return gather()
+        except (RequestException, ConnectionError) as exc:
+            module.fail_json(msg='%s: %s' % (controller, exc))
+
+    def timings():
+        if profile and controller in reports:
+            return dict(bsn_timings=reports[controller])
+        return {}
+
+    snapshots = None
+    if params['facts_delta']:
+        snapshots = FileCache(params['cache_dir'], 'snapshot')
+
+    def delta(controller, facts):
+        # diff against the previous run's facts, then keep these for the next
+        previous = snapshots.get(cache_key(controller))[0]
+        snapshots.set(cache_key(controller), facts)
+        return diff_facts(previous or {}, facts)
+
+    def respond(facts, **result):
+        if snapshots is None:
+            module.exit_json(ansible_facts={name: facts}, **result)
+        result[name + '_delta'] = delta(controller, facts)
+        module.exit_json(changed=bool(result[name + '_delta']), **result)
+
+    cache = None
+    if params['facts_cache']:
+        cache = FileCache(params['cache_dir'], 'facts')
+
+    if params['controllers'] is not None:
+        # one pool carries the REST calls of every controller
+        pool = RequestPool(params['controller_concurrency'] * params['max_concurrency'])
+
+        def gather_one(controller):
+            if cache is None:
+                return gather(controller)[1]
+            cached, age = cache.get(cache_key(controller))
+            if cached is not None and age < params['facts_cache_ttl']:
+                return cached
+            facts = gather(controller)[1]
+            cache.set(cache_key(controller), facts)
+            return facts
+
+        results = gather_controllers(params['controllers'], gather_one,
+                                     params['controller_concurrency'])
+        pool.close()
+        for each, report in reports.items():
+            results[each]['timings'] = report
+        if all(result['error'] for result in results.values()):
+            module.fail_json(msg='no controller could be queried',
+                             **{name + '_controllers': results})
+        if snapshots is not None:
+            for each, result in results.items():
+                facts = result.pop('facts')
+                result['delta'] = None if facts is None else delta(each, facts)
+            module.exit_json(changed=any(result['delta'] for result in results.values()),
+                             **{name + '_controllers': results})
+        module.exit_json(ansible_facts={name + '_controllers': results})
+
+    if cache is None:
+        fabric, facts = gather_or_fail()
+        respond(facts, bsn_connection=fabric.connection_stats(), **timings())
+
+    key = cache_key(controller)
+    ttl = params['facts_cache_ttl']
+    cached, age = cache.get(key)
+
+    if cached is not None and age < ttl:
+        respond(cached, bsn_facts_cache=dict(status='hit', age=round(age, 1)))
+
+    if cached is not None and age < ttl + params['stale_while_revalidate']:
+        # serve the stale facts now, refresh them after ansible has its result
+        # unless a concurrent run already claimed the refresh
+        if cache.claim(key, params['read_timeout']):
+            def refresh():
+                try:
+                    cache.set(key, gather()[1])
+                finally:
+                    cache.release(key)
+            run_detached(refresh)
+        respond(cached, bsn_facts_cache=dict(status='stale', age=round(age, 1)))
+
+    fabric, facts = gather_or_fail()
+    cache.set(key, facts)
+
+    respond(facts, bsn_connection=fabric.connection_stats(),
+            bsn_facts_cache=dict(status='miss', age=0), **timings())
@@ -0,0 +1,61 @@
+# Copyright 2016 Jason Edelman <jason@networktocode.com>
+# Network to Code, LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+Loads this checkout's bsn.py and library modules for code that runs on
+the Ansible controller rather than as a module: the inventory and httpapi
+plugins and the tools. Import it with module_utils on sys.path.
+'''
+
+import os
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+
+
+def load_source(name, path):
+    try:
+        from importlib.util import spec_from_file_location, module_from_spec
+    except ImportError:
+        import imp
+        return imp.load_source(name, path)
+    spec = spec_from_file_location(name, path)
+    module = module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def load_bsn():
+    '''
+    module_utils/bsn.py, importable as ansible.module_utils.bsn the way
+    ansible ships it with the modules
+    '''
+    import ansible.module_utils
+    try:
+        from ansible.module_utils import bsn
+    except ImportError:
+        bsn = load_source('ansible.module_utils.bsn', os.path.join(HERE, 'bsn.py'))
+        ansible.module_utils.bsn = bsn
+    return bsn
+
+
+def load_library(name, module_name=None):
+    '''
+    a module of the library directory, after bsn.py it imports
+    '''
+    load_bsn()
+    return load_source(module_name or name, os.path.join(ROOT, 'library', name + '.py'))
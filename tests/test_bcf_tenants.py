@@ -0,0 +1,214 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'module_utils'))
+from bsn_loader import load_library
+
+bcf_tenants = load_library('bcf_tenants')
+
+TENANT = bcf_tenants.TENANT_URI + '[name="%s"]'
+
+WEB = dict(name='web',
+           port_group_rules=[{'port-group': 'any', 'vlan': 1000}],
+           switch_port_rules=[{'switch': 'any', 'interface': 'any', 'vlan': 1000}])
+
+
+def controller_tenant(name, segments=(), router=None):
+    '''
+    a tenant the way the controller's tenant list GET returns it
+    '''
+    tenant = {'name': name, 'segment': list(segments)}
+    if router is not None:
+        tenant['logical-router'] = router
+    return tenant
+
+
+def controller_segment(name, port_group_rules=(), switch_port_rules=()):
+    return {'name': name,
+            'port-group-membership-rule': list(port_group_rules),
+            'switch-port-membership-rule': list(switch_port_rules)}
+
+
+def controller_router(interfaces):
+    return {'segment-interface': [
+        {'segment': segment,
+         'ip-subnet': [{'ip-cidr': cidr, 'private': 'false'} for cidr in cidrs]}
+        for segment, cidrs in sorted(interfaces.items())]}
+
+
+def calls(operations):
+    return [(verb, uri) for verb, uri, _ in operations]
+
+
+class NormalizeTest(unittest.TestCase):
+
+    def test_desired_defaults(self):
+        self.assertEqual(bcf_tenants.normalize_desired([{'name': 'A'}]),
+                         {'A': dict(segments={}, interfaces={})})
+        state = bcf_tenants.normalize_desired([dict(
+            name='A', segments=[{'name': 'db'}],
+            segment_interfaces=[{'segment': 'db'}])])
+        self.assertEqual(state['A']['segments'],
+                         {'db': {'port-group-membership-rule': [],
+                                 'switch-port-membership-rule': []}})
+        self.assertEqual(state['A']['interfaces'], {'db': []})
+
+    def test_desired_rules_and_subnets(self):
+        state = bcf_tenants.normalize_desired([dict(
+            name='A', segments=[WEB],
+            segment_interfaces=[{'segment': 'web', 'ip_subnets': ['10.1.1.1/24']}])])
+        self.assertEqual(state['A']['segments']['web']['port-group-membership-rule'],
+                         WEB['port_group_rules'])
+        self.assertEqual(state['A']['interfaces'], {'web': ['10.1.1.1/24']})
+
+    def test_desired_missing_name(self):
+        self.assertRaises(KeyError, bcf_tenants.normalize_desired, [{'segments': []}])
+
+    def test_current_router_shapes(self):
+        router = controller_router({'web': ['10.1.1.1/24']})
+        for shape, has_router in ((router, True), ([router], True), ([], False),
+                                  (None, False)):
+            state = bcf_tenants.normalize_current([controller_tenant('A', router=shape)])
+            self.assertEqual(state['A']['router'], has_router, shape)
+            self.assertEqual(state['A']['interfaces'],
+                             {'web': ['10.1.1.1/24']} if has_router else {})
+
+    def test_current_router_without_interfaces(self):
+        state = bcf_tenants.normalize_current([controller_tenant('A', router={})])
+        self.assertEqual(state['A'], dict(segments={}, interfaces={}, router=True))
+
+    def test_current_segments(self):
+        segment = controller_segment('web', [{'port-group': 'any', 'vlan': '1000'}])
+        state = bcf_tenants.normalize_current([controller_tenant('A', [segment])])
+        self.assertEqual(state['A']['segments'],
+                         {'web': {'port-group-membership-rule': [{'port-group': 'any',
+                                                                  'vlan': '1000'}],
+                                  'switch-port-membership-rule': []}})
+
+
+class PlanTest(unittest.TestCase):
+
+    def desired(self, *tenants):
+        return bcf_tenants.normalize_desired(tenants)
+
+    def current(self, *tenants):
+        return bcf_tenants.normalize_current(tenants)
+
+    def test_new_tenant_parents_first(self):
+        desired = self.desired(dict(
+            name='A', segments=[WEB],
+            segment_interfaces=[{'segment': 'web', 'ip_subnets': ['10.1.1.1/24']}]))
+        tenant = TENANT % 'A'
+        interface = tenant + '/logical-router/segment-interface[segment="web"]'
+        operations = bcf_tenants.plan({}, desired)
+        self.assertEqual(calls(operations), [
+            ('PUT', tenant),
+            ('PUT', tenant + '/segment[name="web"]'),
+            ('POST', tenant + '/segment[name="web"]/port-group-membership-rule'),
+            ('POST', tenant + '/segment[name="web"]/switch-port-membership-rule'),
+            ('PUT', tenant + '/logical-router'),
+            ('PUT', interface),
+            ('POST', interface + '/ip-subnet'),
+        ])
+        self.assertEqual(operations[-1][2], {'ip-cidr': '10.1.1.1/24', 'private': 'false'})
+
+    def test_levels_span_tenants(self):
+        desired = self.desired({'name': 'B', 'segments': [{'name': 'x'}]},
+                               {'name': 'A', 'segments': [{'name': 'y'}]})
+        self.assertEqual(calls(bcf_tenants.plan({}, desired)), [
+            ('PUT', TENANT % 'A'),
+            ('PUT', TENANT % 'B'),
+            ('PUT', TENANT % 'A' + '/segment[name="y"]'),
+            ('PUT', TENANT % 'B' + '/segment[name="x"]'),
+        ])
+
+    def test_idempotent(self):
+        desired = self.desired(dict(
+            name='A', segments=[WEB, {'name': 'db'}],
+            segment_interfaces=[{'segment': 'web', 'ip_subnets': ['10.1.1.1/24']}]))
+        # the controller answers with strings and fields of its own
+        current = self.current(controller_tenant(
+            'A',
+            [controller_segment('web',
+                                [{'port-group': 'any', 'vlan': '1000'}],
+                                [{'switch': 'any', 'interface': 'any', 'vlan': '1000',
+                                  'origin': 'user'}]),
+             controller_segment('db')],
+            [controller_router({'web': ['10.1.1.1/24']})]))
+        self.assertEqual(bcf_tenants.plan(current, desired), [])
+        self.assertEqual(bcf_tenants.plan(current, desired, purge=True), [])
+
+    def test_router_created_once(self):
+        desired = self.desired(dict(
+            name='A', segment_interfaces=[{'segment': 'web', 'ip_subnets': ['10.1.1.1/24']},
+                                          {'segment': 'db'}]))
+        self.assertEqual([uri for verb, uri in calls(bcf_tenants.plan({}, desired))
+                          if uri.endswith('/logical-router')],
+                         [TENANT % 'A' + '/logical-router'])
+
+    def test_router_kept_when_present(self):
+        desired = self.desired(dict(
+            name='A', segment_interfaces=[{'segment': 'web', 'ip_subnets': ['10.1.1.1/24']}]))
+        interface = TENANT % 'A' + '/logical-router/segment-interface[segment="web"]'
+        current = self.current(controller_tenant('A', router={}))
+        self.assertEqual(calls(bcf_tenants.plan(current, desired)),
+                         [('PUT', interface), ('POST', interface + '/ip-subnet')])
+
+    def test_no_router_without_interfaces(self):
+        desired = self.desired({'name': 'A', 'segments': [{'name': 'web'}]})
+        current = self.current(controller_tenant('A'))
+        self.assertEqual(calls(bcf_tenants.plan(current, desired)),
+                         [('PUT', TENANT % 'A' + '/segment[name="web"]')])
+
+    def test_subnet_added_to_interface(self):
+        desired = self.desired(dict(
+            name='A', segment_interfaces=[{'segment': 'web',
+                                           'ip_subnets': ['10.1.1.1/24', '10.2.2.1/24']}]))
+        current = self.current(controller_tenant(
+            'A', router=controller_router({'web': ['10.1.1.1/24']})))
+        operations = bcf_tenants.plan(current, desired)
+        self.assertEqual(len(operations), 1)
+        self.assertEqual(operations[0][2], {'ip-cidr': '10.2.2.1/24', 'private': 'false'})
+
+    def test_extra_state_kept_without_purge(self):
+        current = self.current(
+            controller_tenant('A', [controller_segment('old')],
+                              controller_router({'old': ['10.9.9.1/24']})),
+            controller_tenant('Z'))
+        self.assertEqual(bcf_tenants.plan(current, self.desired({'name': 'A'})), [])
+
+    def test_purge_children_before_parents(self):
+        current = self.current(
+            controller_tenant(
+                'A',
+                [controller_segment('web', [{'port-group': 'any', 'vlan': '1000'}]),
+                 controller_segment('old', [{'port-group': 'any', 'vlan': '5'}])],
+                controller_router({'web': ['10.1.1.1/24', '10.9.9.1/24'],
+                                   'old': ['10.5.5.1/24']})),
+            controller_tenant('Z', [controller_segment('z')]))
+        desired = self.desired(dict(
+            name='A', segments=[{'name': 'web'}, {'name': 'new'}],
+            segment_interfaces=[{'segment': 'web', 'ip_subnets': ['10.1.1.1/24']}]))
+        tenant = TENANT % 'A'
+        interfaces = tenant + '/logical-router/segment-interface'
+        self.assertEqual(calls(bcf_tenants.plan(current, desired, purge=True)), [
+            ('DELETE', interfaces + '[segment="old"]'),
+            ('DELETE', interfaces + '[segment="web"]/ip-subnet[ip-cidr="10.9.9.1/24"]'),
+            ('DELETE', tenant + '/segment[name="web"]/port-group-membership-rule'
+                                '[port-group="any"][vlan="1000"]'),
+            # the segment takes its rules along, the tenant its segments
+            ('DELETE', tenant + '/segment[name="old"]'),
+            ('DELETE', TENANT % 'Z'),
+            ('PUT', tenant + '/segment[name="new"]'),
+        ])
+
+    def test_purge_everything(self):
+        current = self.current(controller_tenant('A'), controller_tenant('B'))
+        self.assertEqual(calls(bcf_tenants.plan(current, {}, purge=True)),
+                         [('DELETE', TENANT % 'A'), ('DELETE', TENANT % 'B')])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,121 @@
+import os
+import sys
+import copy
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'module_utils'))
+import bsn
+
+
+def node(dpid, name, state='connected'):
+    return dict(dpid=dpid, name=name, role='leaf', fabric_state=state, sw='3.5.0')
+
+
+FACTS = dict(
+    version='3.5.0',
+    hostname='controller',
+    fabric_nodes=[node('00:01', 'L1'), node('00:02', 'L2')],
+    cluster=dict(name='bigswitchcluster', virtual_ip=None,
+                 controllers=[dict(hostname='10.0.0.1', role='active', uptime=100),
+                              dict(hostname='10.0.0.2', role='standby', uptime=90)]),
+    summary=dict(leaves_connected=2, errors=0),
+)
+
+
+class DiffFactsTest(unittest.TestCase):
+
+    def changed(self, **updates):
+        facts = copy.deepcopy(FACTS)
+        facts.update(updates)
+        return facts
+
+    def test_unchanged(self):
+        self.assertEqual(bsn.diff_facts(FACTS, copy.deepcopy(FACTS)), {})
+
+    def test_first_run(self):
+        delta = bsn.diff_facts({}, FACTS)
+        self.assertEqual(delta['fabric_nodes'],
+                         dict(added=FACTS['fabric_nodes'], removed=[], changed=[]))
+        self.assertEqual(delta['summary'],
+                         {'leaves_connected': {'old': None, 'new': 2},
+                          'errors': {'old': None, 'new': 0}})
+        self.assertEqual(delta['controller_roles'],
+                         {'10.0.0.1': {'old': None, 'new': 'active'},
+                          '10.0.0.2': {'old': None, 'new': 'standby'}})
+        self.assertEqual(delta['facts'],
+                         {'version': {'old': None, 'new': '3.5.0'},
+                          'hostname': {'old': None, 'new': 'controller'}})
+
+    def test_nodes_added_removed_changed(self):
+        current = self.changed(fabric_nodes=[node('00:03', 'L3'),
+                                             node('00:02', 'L2', state='disconnected')])
+        self.assertEqual(bsn.diff_facts(FACTS, current), dict(fabric_nodes=dict(
+            added=[node('00:03', 'L3')],
+            removed=[node('00:01', 'L1')],
+            changed=[dict(dpid='00:02', changes={'fabric_state': {
+                'old': 'connected', 'new': 'disconnected'}})],
+        )))
+
+    def test_nodes_sorted_by_dpid(self):
+        current = self.changed(fabric_nodes=[node('00:09', 'L9'), node('00:05', 'L5')] +
+                               FACTS['fabric_nodes'])
+        added = bsn.diff_facts(FACTS, current)['fabric_nodes']['added']
+        self.assertEqual([each['dpid'] for each in added], ['00:05', '00:09'])
+
+    def test_summary_keys_added_removed_changed(self):
+        current = self.changed(summary=dict(leaves_connected=1, warnings=3))
+        self.assertEqual(bsn.diff_facts(FACTS, current), dict(summary={
+            'leaves_connected': {'old': 2, 'new': 1},
+            'errors': {'old': 0, 'new': None},
+            'warnings': {'old': None, 'new': 3},
+        }))
+
+    def test_controller_roles_without_uptime(self):
+        cluster = copy.deepcopy(FACTS['cluster'])
+        for controller in cluster['controllers']:
+            controller['uptime'] += 60
+        self.assertEqual(bsn.diff_facts(FACTS, self.changed(cluster=cluster)), {})
+        cluster['controllers'][0]['role'] = 'standby'
+        cluster['controllers'][1]['role'] = 'active'
+        self.assertEqual(bsn.diff_facts(FACTS, self.changed(cluster=cluster)),
+                         dict(controller_roles={
+                             '10.0.0.1': {'old': 'active', 'new': 'standby'},
+                             '10.0.0.2': {'old': 'standby', 'new': 'active'}}))
+
+    def test_cluster_fields(self):
+        cluster = dict(FACTS['cluster'], virtual_ip='10.0.0.10')
+        self.assertEqual(bsn.diff_facts(FACTS, self.changed(cluster=cluster)),
+                         dict(cluster={'virtual_ip': {'old': None, 'new': '10.0.0.10'}}))
+
+    def test_cluster_not_a_dict(self):
+        # bmf reports the cluster as a string
+        previous = self.changed(cluster='N/A')
+        self.assertEqual(bsn.diff_facts(previous, copy.deepcopy(previous)), {})
+        self.assertEqual(bsn.diff_facts(previous, self.changed(cluster='other')),
+                         dict(facts={'cluster': {'old': 'N/A', 'new': 'other'}}))
+        delta = bsn.diff_facts(previous, FACTS)
+        self.assertEqual(sorted(delta), ['cluster', 'controller_roles'])
+        self.assertEqual(delta['cluster']['name'], {'old': None, 'new': 'bigswitchcluster'})
+
+    def test_other_facts_nested(self):
+        previous = self.changed(extra=dict(a=[1, 2], b=dict(c=1)))
+        current = self.changed(extra=dict(a=[1, 2, 3], b=dict(c=1)), platform='x')
+        self.assertEqual(bsn.diff_facts(previous, current), dict(facts={
+            'extra': {'old': dict(a=[1, 2], b=dict(c=1)),
+                      'new': dict(a=[1, 2, 3], b=dict(c=1))},
+            'platform': {'old': None, 'new': 'x'},
+        }))
+        self.assertEqual(bsn.diff_facts(previous, copy.deepcopy(previous)), {})
+
+    def test_removed_facts(self):
+        current = copy.deepcopy(FACTS)
+        del current['version']
+        del current['fabric_nodes']
+        delta = bsn.diff_facts(FACTS, current)
+        self.assertEqual(delta['facts'], {'version': {'old': '3.5.0', 'new': None}})
+        self.assertEqual(delta['fabric_nodes']['removed'], FACTS['fabric_nodes'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+import os
+import sys
+import json
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'module_utils'))
+import bsn
+
+
+ITEMS = [
+    {'name': 'L1', 'dpid': '00:01', 'uptime': 12.5, 'port': 49},
+    -17,
+    1.25e-3,
+    6e21,
+    {'name': 'L,2]', 'attributes': {'description-data': 'x', 'other': [1, 2]}},
+    True,
+    None,
+    [3.5, 'y'],
+    1234567,
+]
+
+FIELDS = ['name', 'attributes.description-data']
+
+
+def every_split(text):
+    '''
+    the text in two chunks, cut at each position in turn
+    '''
+    for cut in range(1, len(text)):
+        yield [text[:cut], text[cut:]]
+
+
+class LoadProjectedTest(unittest.TestCase):
+
+    def expected(self):
+        return [bsn.projector(FIELDS)(item) for item in ITEMS]
+
+    def test_items_cut_at_every_chunk_boundary(self):
+        for indent in (None, 1):
+            text = json.dumps(ITEMS, indent=indent)
+            for chunks in every_split(text):
+                self.assertEqual(bsn.load_projected(chunks, FIELDS), self.expected(),
+                                 'cut at %d' % len(chunks[0]))
+
+    def test_one_character_chunks(self):
+        text = json.dumps(ITEMS)
+        self.assertEqual(bsn.load_projected(list(text), FIELDS), self.expected())
+
+    def test_number_cut_before_fraction_or_exponent(self):
+        self.assertEqual(bsn.load_projected(['[12', '.5]'], []), [12.5])
+        self.assertEqual(bsn.load_projected(['[1e', '3, 2]'], []), [1000.0, 2])
+        self.assertEqual(bsn.load_projected(['[4', '2 ', ']'], []), [42])
+
+    def test_projection_keeps_nested_fields(self):
+        self.assertEqual(bsn.load_projected(['[{"name": "a", "attributes": ',
+                                             '{"description-data": "d", "x": 1}, "y": 2}]'],
+                                            FIELDS),
+                         [{'name': 'a', 'attributes': {'description-data': 'd'}}])
+
+    def test_non_list_and_empty_bodies(self):
+        self.assertEqual(bsn.load_projected(['{"name"', ': "a", "y": 1}'], FIELDS),
+                         {'name': 'a', 'y': 1})
+        self.assertEqual(bsn.load_projected([], FIELDS), None)
+        self.assertEqual(bsn.load_projected([' \n'], FIELDS), None)
+        self.assertEqual(bsn.load_projected([' [', ' ]'], FIELDS), [])
+
+    def test_truncated_list(self):
+        for chunks in (['[1', ','], ['[{"name": "a"}'], ['[12']):
+            self.assertRaises(ValueError, bsn.load_projected, chunks, FIELDS)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,292 @@
+#!/usr/bin/env python
+
+# Copyright 2016 Jason Edelman <jason@networktocode.com>
+# Network to Code, LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+Benchmark the modules in library/ against tools/mock_controller.py.
+
+Starts a mock controller, then runs each target in a fresh interpreter and
+reports end-to-end latency (login included), the number of REST requests
+the controller saw and the peak RSS of the run:
+
+    python tools/benchmark.py --switches 5000 --latency 20 --repeat 5 \\
+        --option max_concurrency=8
+
+Targets are run with the same interpreter as this script, so use the one
+the modules run under on the Ansible host.
+'''
+
+import os
+import sys
+import json
+import time
+import socket
+import inspect
+import argparse
+import resource
+import subprocess
+
+try:
+    from urllib2 import urlopen, Request
+except ImportError:
+    from urllib.request import urlopen, Request
+
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+MODULE_UTILS = os.path.join(os.path.dirname(HERE), 'module_utils')
+
+sys.path.insert(0, MODULE_UTILS)
+from bsn_loader import load_library
+
+_loaded = {}
+
+
+def load(name):
+    if name in _loaded:
+        return _loaded[name]
+    # what ansible does when it ships a module: make the repository's
+    # module_utils importable as ansible.module_utils.<name>
+    module = load_library(name)
+    _loaded[name] = module
+    return module
+
+
+def accepted(cls, options):
+    '''
+    keep only the options the target's client constructor takes, its own
+    and those it passes on to the constructors of its base classes
+    '''
+    names = set()
+    for klass in inspect.getmro(cls):
+        if klass is object or '__init__' not in vars(klass):
+            continue
+        try:
+            names.update(inspect.getfullargspec(klass.__init__).args)
+        except AttributeError:
+            names.update(inspect.getargspec(klass.__init__).args)
+    return dict((key, value) for key, value in options.items() if key in names)
+
+
+def run_bcf_get_facts(args, options):
+    module = load('bcf_get_facts')
+    subset = options.pop('gather_subset', None)
+    fabric = module.BigCloudFabric(controller_ip=args.host,
+                                   port=str(args.bcf_port),
+                                   protocol='http',
+                                   **accepted(module.BigCloudFabric, options))
+    return fabric.facts(subset)
+
+
+def run_bmf_get_facts(args, options):
+    module = load('bmf_get_facts')
+    subset = options.pop('gather_subset', None)
+    fabric = module.BigCloudFabric(controller_ip=args.host,
+                                   port=str(args.bmf_port),
+                                   protocol='http',
+                                   **accepted(module.BigCloudFabric, options))
+    return fabric.facts(subset)
+
+
+def run_bcf_methods(args, options):
+    module = load('bcf_methods')
+    # keyword arguments its constructor takes out of **kwargs
+    extra = dict((key, options.pop(key)) for key in ('journal', 'composed_writes')
+                 if key in options)
+    extra.update(accepted(module.BigCloudFabric, options))
+    fabric = module.BigCloudFabric(controller_ip=args.host,
+                                   port=str(args.bcf_port),
+                                   protocol='http',
+                                   **extra)
+    fabric.facts()
+    fabric.provision_switch('bench-leaf', '70:72:cf:bd:de:78', 'leaf')
+    fabric.create_tenant('bench')
+    fabric.create_segment('bench', 'web', '1000', 'any', 'any', 'any')
+    fabric.create_logical_segment_interface('bench', 'web', '10.1.1.1/24')
+
+
+TARGETS = {
+    'bcf_get_facts': run_bcf_get_facts,
+    'bmf_get_facts': run_bmf_get_facts,
+    'bcf_methods': run_bcf_methods,
+}
+
+
+def child(args):
+    '''
+    run one target in this (fresh) interpreter and print its measurements
+    '''
+    options = json.loads(args.child_options)
+    measured = dict(elapsed=None, rss_before=None, rss_peak=None, error=None)
+    try:
+        # import time is not part of the module's work, keep it out of the numbers
+        load(args.child)
+    except Exception as exc:
+        measured['error'] = 'loading failed, %s: %s' % (type(exc).__name__, exc)
+        sys.stdout.write(json.dumps(measured) + '\n')
+        return
+    measured['rss_before'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.time()
+    try:
+        TARGETS[args.child](args, options)
+    except Exception as exc:
+        # with --error-rate some runs are expected to give up
+        measured['error'] = '%s: %s' % (type(exc).__name__, exc)
+    measured['elapsed'] = time.time() - start
+    measured['rss_peak'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    sys.stdout.write(json.dumps(measured) + '\n')
+
+
+def run_child(command):
+    '''
+    one run of a target; a child that crashed counts as a failed run
+    '''
+    proc = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    output, errors = proc.communicate()
+    try:
+        return json.loads(output.decode('utf-8').strip().splitlines()[-1])
+    except (IndexError, ValueError):
+        lines = errors.decode('utf-8', 'replace').strip().splitlines() or ['no output']
+        return dict(elapsed=None, rss_before=None, rss_peak=None,
+                    error='exited with %d, %s' % (proc.returncode, lines[-1]))
+
+
+def mock_call(args, path):
+    url = 'http://%s:%d%s' % (args.host, args.bmf_port, path)
+    data = b'{}' if path == '/mock/reset' else None
+    return json.loads(urlopen(Request(url, data)).read().decode('utf-8'))
+
+
+def start_mock(args):
+    command = [sys.executable, os.path.join(HERE, 'mock_controller.py'),
+               '--host', args.host,
+               '--bcf-port', str(args.bcf_port),
+               '--bmf-port', str(args.bmf_port),
+               '--switches', str(args.switches),
+               '--tenants', str(args.tenants),
+               '--segments', str(args.segments),
+               '--bmf-switches', str(args.bmf_switches or args.switches),
+               '--latency', str(args.latency),
+               '--error-rate', str(args.error_rate)]
+    mock = subprocess.Popen(command, stdout=subprocess.PIPE)
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            socket.create_connection((args.host, args.bmf_port), 1).close()
+            return mock
+        except socket.error:
+            time.sleep(0.1)
+    mock.kill()
+    raise SystemExit('mock controller did not start')
+
+
+def parse_options(pairs):
+    options = {}
+    for pair in pairs:
+        key, _, value = pair.partition('=')
+        try:
+            options[key] = json.loads(value)
+        except ValueError:
+            options[key] = value.split(',') if key == 'gather_subset' else value
+    return options
+
+
+def summarize(name, runs):
+    failed = [run for run in runs if run.get('error')]
+    elapsed = sorted(run['elapsed'] for run in runs if run['elapsed'] is not None)
+    measured = [run for run in runs if run['rss_peak'] is not None]
+    return dict(
+        target=name,
+        runs=len(runs),
+        failed=len(failed),
+        min=round(elapsed[0], 4) if elapsed else None,
+        median=round(elapsed[len(elapsed) // 2], 4) if elapsed else None,
+        max=round(elapsed[-1], 4) if elapsed else None,
+        requests=runs[-1]['requests'],
+        rss_peak_kb=max(run['rss_peak'] for run in measured) if measured else None,
+        rss_delta_kb=(max(run['rss_peak'] - run['rss_before'] for run in measured)
+                      if measured else None),
+        error=failed[-1]['error'] if failed else None,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--bcf-port', type=int, default=18443)
+    parser.add_argument('--bmf-port', type=int, default=18082)
+    parser.add_argument('--switches', type=int, default=9)
+    parser.add_argument('--tenants', type=int, default=0)
+    parser.add_argument('--segments', type=int, default=0)
+    parser.add_argument('--bmf-switches', type=int, default=0,
+                        help='defaults to --switches')
+    parser.add_argument('--latency', type=float, default=0,
+                        help='milliseconds added to every request')
+    parser.add_argument('--error-rate', type=float, default=0,
+                        help='share of requests the mock answers with a 503')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--targets', default=','.join(sorted(TARGETS)))
+    parser.add_argument('--option', action='append', default=[],
+                        metavar='KEY=VALUE',
+                        help='client keyword argument, e.g. max_concurrency=8')
+    parser.add_argument('--json', action='store_true',
+                        help='print the results as json')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    parser.add_argument('--child-options', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        return child(args)
+
+    options = parse_options(args.option)
+    mock = start_mock(args)
+    results = []
+    try:
+        for name in args.targets.split(','):
+            runs = []
+            for _ in range(args.repeat):
+                mock_call(args, '/mock/reset')
+                command = [sys.executable, os.path.abspath(__file__),
+                           '--host', args.host,
+                           '--bcf-port', str(args.bcf_port),
+                           '--bmf-port', str(args.bmf_port),
+                           '--child', name,
+                           '--child-options', json.dumps(options)]
+                run = run_child(command)
+                run['requests'] = mock_call(args, '/mock/stats')['total']
+                runs.append(run)
+            results.append(summarize(name, runs))
+    finally:
+        mock.kill()
+
+    if args.json:
+        sys.stdout.write(json.dumps(results, indent=4) + '\n')
+        return
+    columns = ['target', 'runs', 'failed', 'min', 'median', 'max', 'requests',
+               'rss_peak_kb', 'rss_delta_kb']
+    rows = [columns] + [['-' if result[column] is None else str(result[column])
+                         for column in columns]
+                        for result in results]
+    widths = [max(len(row[index]) for row in rows) for index in range(len(columns))]
+    for row in rows:
+        sys.stdout.write('  '.join(cell.ljust(width)
+                                   for cell, width in zip(row, widths)) + '\n')
+    for result in results:
+        if result['error']:
+            sys.stdout.write('%s: %s\n' % (result['target'], result['error']))
+
+
+if __name__ == '__main__':
+    main()
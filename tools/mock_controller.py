@@ -0,0 +1,484 @@
+#!/usr/bin/env python
+
+# Copyright 2016 Jason Edelman <jason@networktocode.com>
+# Network to Code, LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+Local stand-in for a Big Cloud Fabric / Big Monitoring Fabric controller.
+
+Serves the login endpoints and every REST resource used by the modules in
+library/ from an in-memory fabric of configurable size, with optional
+per-request latency, so the modules can be exercised and benchmarked
+without a lab:
+
+    python tools/mock_controller.py --switches 2000 --tenants 500 --latency 20
+
+GET /mock/stats returns request counters, POST /mock/reset clears them.
+POST /mock/faults {"error_rate": 0.3} makes that share of the REST calls
+fail with a 503, like an overloaded controller. With --etags GETs carry an
+ETag and are answered 304 Not Modified when If-None-Match still matches.
+With --flat-writes a write whose body nests lists or objects is refused
+with a 400, like a controller that takes one resource per call.
+'''
+
+import re
+import ssl
+import sys
+import json
+import time
+import uuid
+import hashlib
+import random
+import argparse
+import threading
+
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urllib import unquote
+except ImportError:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import unquote
+
+
+DATA_PREFIX = '/api/v1/data/controller/'
+
+# path step such as tenant[name="A"] or rule[vlan="10"][port-group="any"]
+STEP = re.compile(r'^([\w-]+)((?:\[[\w-]+\s*=\s*"[^"]*"\])*)$')
+PREDICATE = re.compile(r'\[([\w-]+)\s*=\s*"([^"]*)"\]')
+
+# list entries are matched on these fields when written without a predicate
+LIST_KEYS = {
+    'switch-config': 'name',
+    'tenant': 'name',
+    'segment': 'name',
+    'segment-interface': 'segment',
+    'ip-subnet': 'ip-cidr',
+}
+
+# config nodes holding a single object rather than a list
+CONTAINERS = set(['logical-router'])
+
+
+class NotFound(Exception):
+    pass
+
+
+class Fabric(object):
+    '''
+    in-memory controller state: read-only operational data generated from
+    the fabric size, plus a writable config tree for the provisioning calls
+    '''
+
+    def __init__(self, switches=9, tenants=0, segments=0, bmf_switches=3):
+        self.lock = threading.Lock()
+        self.config = dict(core={'switch-config': []},
+                           applications=dict(bcf=dict(tenant=[])))
+        self.nodes = []
+        spines = max(1, switches // 10)
+        for index in range(switches):
+            role = 'spine' if index < spines else 'leaf'
+            raw = '%016x' % (index + 1)
+            dpid = ':'.join(raw[i:i + 2] for i in range(0, 16, 2))
+            self.nodes.append({
+                'name': '%s%d' % ('S' if role == 'spine' else 'L', index + 1),
+                'dpid': dpid,
+                'fabric-role': role,
+                'fabric-connection-state': 'connected',
+                'software-description': 'Switch Light Virtual 3.5.0',
+                'leaf-group': 'rack%d' % (index // 2) if role == 'leaf' else None,
+                'connected-since': '2016-01-01T00:00:00.000Z',
+                'handshake-state': 'active',
+                'ip-address': '10.0.%d.%d' % (index // 250, index % 250 + 1),
+            })
+            self.config['core']['switch-config'].append(
+                {'name': self.nodes[-1]['name'], 'dpid': dpid,
+                 'fabric-role': role})
+        for tenant in range(tenants):
+            self.config['applications']['bcf']['tenant'].append({
+                'name': 'tenant%d' % tenant,
+                'segment': [{'name': 'segment%d' % segment}
+                            for segment in range(segments)],
+            })
+        self.bmf_switches = []
+        for index in range(bmf_switches):
+            self.bmf_switches.append({
+                'alias': 'bmf-switch-%d' % index,
+                'dpid': '00:00:00:00:00:00:%02x:%02x' % (index // 256, index % 256),
+                'attributes': {'description-data': {
+                    'serial-number': 'SN%06d' % index,
+                    'software-description': 'Switch Light Virtual 3.1.0',
+                    'manufacturer-description': 'Big Switch Networks',
+                    'hardware-description': 'Virtual'}},
+            })
+
+    def operational(self, path):
+        nodes = self.nodes
+        tenants = self.config['applications']['bcf']['tenant']
+        if path == 'core/version/appliance':
+            return [{'version': '3.5.0',
+                     'release-string': 'Big Cloud Fabric Appliance 3.5.0 (bcf-3.5.0 #75)'}]
+        if path == 'os/config/local':
+            return [{'network': {
+                'hostname': 'controller',
+                'interface': [{'ipv4': {'dns': {'search-path': ['example.com']}}}]}}]
+        if path == 'cluster':
+            return [{'name': 'bigswitchcluster'}]
+        if path == 'core/high-availability/redundancy-status':
+            return [{'status': 'standalone', 'message': 'Single node configured'}]
+        if path == 'core/high-availability/node':
+            return [{'hostname': '10.10.12.20', 'role': 'active',
+                     'uptime': 33807223, 'node-id': 1}]
+        if path == 'os/config/global/virtual-ip':
+            return [{}]
+        if path == 'applications/bcf/info/fabric/switch':
+            return nodes
+        if path == 'applications/bcf/info/summary/fabric':
+            spines = [node for node in nodes if node['fabric-role'] == 'spine']
+            return [{
+                'overall-status': 'OK',
+                'errors': 0,
+                'warnings': 0,
+                'num-leaves-configured': len(nodes) - len(spines),
+                'num-leaves-connected': len(nodes) - len(spines),
+                'num-leaf-groups-configured': (len(nodes) - len(spines) + 1) // 2,
+                'num-spines-configured': len(spines),
+                'num-spines-connected': len(spines),
+                'num-controller-nodes': 1,
+                'num-vswitches-connected': 0,
+                'tenant-count': len(tenants),
+            }]
+        if path == 'core/zerotouch/device':
+            return [{'name': node['name'], 'dpid': node['dpid'],
+                     'reload-pending': False, 'state': 'ok'} for node in nodes]
+        if path == 'core/switch':
+            return self.bmf_switches
+        if path == 'applications/bigtap/info':
+            return [{'num-total-switches': len(self.bmf_switches),
+                     'match-mode': 'bigtap-l3l4', 'num-services': 0,
+                     'num-policies': 0, 'num-active-policies': 0,
+                     'num-filter-switches': 1, 'num-delivery-switches': 1,
+                     'num-service-switches': 1, 'num-core-interfaces': 4,
+                     'num-filter-interfaces': 1, 'num-delivery-interfaces': 2,
+                     'num-service-interfaces': 2}]
+        return None
+
+    def _steps(self, path):
+        steps = []
+        for part in re.split(r'/(?![^\[]*\])', path):
+            match = STEP.match(part)
+            if not match:
+                raise NotFound(path)
+            steps.append((match.group(1), PREDICATE.findall(match.group(2))))
+        return steps
+
+    def _matches(self, item, predicates):
+        return all(str(item.get(key)) == value for key, value in predicates)
+
+    def _walk(self, steps, create):
+        '''
+        follow all but the last step through the config tree and return
+        the object the last step applies to
+        '''
+        node = self.config
+        for field, predicates in steps[:-1]:
+            child = node.get(field)
+            if child is None and create and (field in CONTAINERS or not predicates):
+                child = node[field] = {}
+            if isinstance(child, list):
+                found = [item for item in child if self._matches(item, predicates)]
+                if not found:
+                    raise NotFound(field)
+                child = found[0]
+            if not isinstance(child, dict):
+                raise NotFound(field)
+            node = child
+        return node
+
+    def get(self, path):
+        data = self.operational(path)
+        if data is not None:
+            return data
+        steps = self._steps(path)
+        field, predicates = steps[-1]
+        with self.lock:
+            try:
+                parent = self._walk(steps, create=False)
+            except NotFound:
+                return []
+            child = parent.get(field)
+            if child is None:
+                return []
+            if isinstance(child, dict):
+                return [child]
+            return [item for item in child if self._matches(item, predicates)]
+
+    def write(self, verb, path, body):
+        steps = self._steps(path)
+        field, predicates = steps[-1]
+        with self.lock:
+            parent = self._walk(steps, create=True)
+            if verb == 'DELETE':
+                child = parent.get(field)
+                if isinstance(child, list):
+                    parent[field] = [item for item in child
+                                     if not self._matches(item, predicates)]
+                elif not predicates:
+                    parent.pop(field, None)
+                return
+            if field in CONTAINERS:
+                if verb == 'PATCH' or field in parent:
+                    merge(parent.setdefault(field, {}), body)
+                else:
+                    parent[field] = body
+                return
+            items = parent.setdefault(field, [])
+            body = dict(body)
+            for key, value in predicates:
+                body.setdefault(key, value)
+            list_key = LIST_KEYS.get(field)
+            for index, item in enumerate(items):
+                if predicates:
+                    same = self._matches(item, predicates)
+                elif list_key is None:
+                    same = item == body
+                else:
+                    same = list_key in body and item.get(list_key) == body[list_key]
+                if same:
+                    if verb == 'PATCH':
+                        merge(item, body)
+                    else:
+                        items[index] = body
+                    return
+            items.append(body)
+
+
+def merge(target, patch):
+    for field, value in patch.items():
+        if isinstance(value, dict) and isinstance(target.get(field), dict):
+            merge(target[field], value)
+        elif isinstance(value, list) and isinstance(target.get(field), list):
+            list_key = LIST_KEYS.get(field)
+            for entry in value:
+                existing = [item for item in target[field]
+                            if list_key and item.get(list_key) == entry.get(list_key)]
+                if existing:
+                    merge(existing[0], entry)
+                elif entry not in target[field]:
+                    target[field].append(entry)
+        else:
+            target[field] = value
+
+
+class MockState(object):
+
+    def __init__(self, fabric, latency=0.0, session_ttl=0, error_rate=0.0,
+                 etags=False, flat_writes=False):
+        self.fabric = fabric
+        self.latency = latency
+        self.session_ttl = session_ttl
+        self.error_rate = error_rate
+        self.etags = etags
+        self.flat_writes = flat_writes
+        self.sessions = {}
+        self.counts = {}
+        self.lock = threading.Lock()
+
+    def count(self, verb, path):
+        with self.lock:
+            name = verb + ' ' + re.sub(r'\[[^\]]*\]', '[]', path)
+            self.counts[name] = self.counts.get(name, 0) + 1
+
+    def stats(self):
+        with self.lock:
+            return dict(total=sum(self.counts.values()), requests=dict(self.counts))
+
+    def login(self):
+        cookie = uuid.uuid4().hex
+        with self.lock:
+            self.sessions[cookie] = time.time()
+        return cookie
+
+    def authorized(self, cookie):
+        with self.lock:
+            created = self.sessions.get(cookie)
+        if created is None:
+            return False
+        return not self.session_ttl or time.time() - created < self.session_ttl
+
+
+class Handler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+    # headers and body go out in separate small writes; with keep-alive
+    # clients nagle would hold each reply back until the delayed ack
+    disable_nagle_algorithm = True
+    state = None
+
+    def log_message(self, *args):
+        pass
+
+    def _reply(self, status, data=None, headers=None):
+        body = json.dumps(data).encode('utf-8') if data is not None else b''
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        raw = self.rfile.read(length) if length else b''
+        try:
+            return json.loads(raw.decode('utf-8')) if raw else {}
+        except ValueError:
+            return {}
+
+    def _cookie(self):
+        match = re.search(r'session_cookie=([^;\s]+)', self.headers.get('Cookie') or '')
+        return match.group(1) if match else None
+
+    def _handle(self, verb):
+        state = self.state
+        path, _, query = self.path.partition('?')
+        path = unquote(path)
+        body = self._body()
+
+        if path == '/mock/stats':
+            return self._reply(200, state.stats())
+        if path == '/mock/reset':
+            with state.lock:
+                state.counts.clear()
+            return self._reply(200, {})
+        if path == '/mock/faults' and verb == 'POST':
+            state.error_rate = float(body.get('error_rate', 0))
+            return self._reply(200, {'error_rate': state.error_rate})
+
+        state.count(verb, path)
+        if state.latency:
+            time.sleep(state.latency)
+        if state.error_rate and random.random() < state.error_rate:
+            return self._reply(503, {'description': 'service unavailable'})
+
+        if path in ('/api/v1/auth/login', '/auth/login') and verb == 'POST':
+            cookie = state.login()
+            return self._reply(200, {'success': True, 'session_cookie': cookie},
+                               {'Set-Cookie': 'session_cookie=%s; Path=/' % cookie})
+        if not path.startswith(DATA_PREFIX):
+            return self._reply(404, {'description': 'unknown path ' + path})
+        if not state.authorized(self._cookie()):
+            return self._reply(401, {'description': 'authorization required'})
+
+        resource = path[len(DATA_PREFIX):]
+        try:
+            if verb == 'GET':
+                data = state.fabric.get(resource)
+                if not state.etags:
+                    return self._reply(200, data)
+                etag = '"%s"' % hashlib.sha1(json.dumps(data, sort_keys=True)
+                                              .encode('utf-8')).hexdigest()
+                if self.headers.get('If-None-Match') == etag:
+                    return self._reply(304, headers={'ETag': etag})
+                return self._reply(200, data, {'ETag': etag})
+            if state.flat_writes and isinstance(body, dict) and any(
+                    isinstance(value, (dict, list)) for value in body.values()):
+                return self._reply(400, {'description': 'nested write not supported'})
+            state.fabric.write(verb, resource, body if isinstance(body, dict) else {})
+        except NotFound as exc:
+            return self._reply(404, {'description': 'no such resource: %s' % exc})
+        return self._reply(204)
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_PUT(self):
+        self._handle('PUT')
+
+    def do_POST(self):
+        self._handle('POST')
+
+    def do_PATCH(self):
+        self._handle('PATCH')
+
+    def do_DELETE(self):
+        self._handle('DELETE')
+
+
+class ThreadedServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 128
+
+
+def serve(state, host, port, certfile=None, keyfile=None):
+    class BoundHandler(Handler):
+        pass
+    BoundHandler.state = state
+    server = ThreadedServer((host, port), BoundHandler)
+    if certfile:
+        context = ssl.SSLContext(getattr(ssl, 'PROTOCOL_TLS_SERVER',
+                                         ssl.PROTOCOL_SSLv23))
+        context.load_cert_chain(certfile, keyfile)
+        server.socket = context.wrap_socket(server.socket, server_side=True)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--bcf-port', type=int, default=8443)
+    parser.add_argument('--bmf-port', type=int, default=8082)
+    parser.add_argument('--certfile', help='serve the BCF port over TLS')
+    parser.add_argument('--keyfile')
+    parser.add_argument('--switches', type=int, default=9)
+    parser.add_argument('--tenants', type=int, default=0)
+    parser.add_argument('--segments', type=int, default=0,
+                        help='segments per tenant')
+    parser.add_argument('--bmf-switches', type=int, default=3)
+    parser.add_argument('--latency', type=float, default=0,
+                        help='milliseconds added to every request')
+    parser.add_argument('--session-ttl', type=float, default=0,
+                        help='seconds before a session cookie is rejected')
+    parser.add_argument('--error-rate', type=float, default=0,
+                        help='share of requests answered with a 503')
+    parser.add_argument('--etags', action='store_true',
+                        help='send ETags and honour If-None-Match')
+    parser.add_argument('--flat-writes', action='store_true',
+                        help='refuse writes with nested lists or objects')
+    args = parser.parse_args()
+
+    fabric = Fabric(args.switches, args.tenants, args.segments, args.bmf_switches)
+    state = MockState(fabric, args.latency / 1000.0, args.session_ttl,
+                      args.error_rate, args.etags, args.flat_writes)
+    serve(state, args.host, args.bcf_port, args.certfile, args.keyfile)
+    serve(state, args.host, args.bmf_port)
+    sys.stdout.write('mock controller on %s: bcf %d, bmf %d\n'
+                     % (args.host, args.bcf_port, args.bmf_port))
+    sys.stdout.flush()
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()